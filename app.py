@@ -1,10 +1,19 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory, stream_with_context
 import os
 import base64
+import shutil
 import tempfile
 from werkzeug.utils import secure_filename
-from model_utils import detector
+from serving import detection_service, loaded_detection_service, start_loading, is_ready, get_models
 from map.detector_adapter import DetectorAdapter
+from map.http_cache import ResponseCache
+from map.detection_stream import event_stream, parse_event_id
+from batch_detection import BatchDetector, archive_kind, items_from_archive, items_from_files, parse_locations, ndjson_lines
+from request_body import (
+    UploadTooLarge, IncompleteUpload, declared_length, read_body, read_location, is_multipart, is_raw_rgb,
+    raw_rgb_image, describe_capabilities
+)
+from model_utils import IMG_SIZE
 
 app = Flask(__name__, 
             template_folder='map/templates',
@@ -17,8 +26,38 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# Initialize detector adapter
-detector_adapter = DetectorAdapter()
+# Initialize detector adapter; the models load on first use, or straight away
+# in the background when FAW_PRELOAD_MODELS is set (gunicorn.conf.py does this per worker)
+detector_adapter = DetectorAdapter(detection_service)
+if os.environ.get('FAW_PRELOAD_MODELS') == '1':
+    start_loading()
+
+# Batch uploads get their own, larger size limit
+BATCH_MAX_CONTENT_LENGTH = int(float(os.environ.get('FAW_BATCH_UPLOAD_MB', '256')) * 1024 * 1024)
+batch_detector = BatchDetector(
+    detection_service, detector_adapter,
+    chunk_size=int(os.environ.get('FAW_BATCH_CHUNK_SIZE', '8')),
+    max_images=int(os.environ.get('FAW_BATCH_MAX_IMAGES', '200')),
+    # The armyworm model has the largest input, so decoding down to it loses nothing
+    decode_size=IMG_SIZE,
+    # An inference sidecar decodes the uploads itself; pixels would not fit its shared memory slots
+    decode=not os.environ.get('FAW_INFERENCE_SIDECAR')
+)
+
+# Detection streams end before the gunicorn worker timeout (30s by default) and the browser reconnects
+STREAM_SECONDS = float(os.environ.get('FAW_STREAM_SECONDS', '20'))
+
+# Serialised, compressed bodies of the map endpoints, rebuilt only when the data changes
+http_cache = ResponseCache()
+
+def cached_json(key, version, build):
+    """Serve JSON from the HTTP cache, answering If-None-Match with 304 and compressing for Accept-Encoding"""
+    status, body, headers = http_cache.respond(
+        key, version, build,
+        if_none_match=request.headers.get('If-None-Match'),
+        accept_encoding=request.headers.get('Accept-Encoding')
+    )
+    return Response(body, status=status, headers=headers, mimetype='application/json')
 
 @app.route('/')
 def index():
@@ -39,15 +78,8 @@ def detect():
         return jsonify({"error": "No file selected"}), 400
     
     try:
-        # Save the file temporarily
-        temp_path = "temp_image.jpg"
-        file.save(temp_path)
-        
-        # Run detection
-        results = detector.detect(temp_path)
-        
-        # Clean up
-        os.remove(temp_path)
+        # Run detection straight from the uploaded bytes
+        results = detection_service.detect(file.read())
         
         return jsonify(results)
     except Exception as e:
@@ -56,14 +88,133 @@ def detect():
 @app.route('/api/districts')
 def get_districts():
     """Get all districts for the map"""
-    districts = detector_adapter.get_all_districts()
-    return jsonify(districts)
+    districts_version, _ = detector_adapter.get_data_versions()
+    return cached_json('districts', districts_version, detector_adapter.get_all_districts)
 
 @app.route('/api/detections')
 def get_detections():
-    """Get detection data for the map"""
-    detections = detector_adapter.get_detection_map_data()
-    return jsonify(detections)
+    """
+    Get detection data for the map: the latest detection per district, or
+    with any of since/until/bucket/type, counts per hour, day or week
+    """
+    params = request.args
+    versions = detector_adapter.get_data_versions()
+    if not any(key in params for key in ('since', 'until', 'bucket', 'type')):
+        return cached_json('detections', versions, detector_adapter.get_detection_map_data)
+    
+    def build():
+        return detector_adapter.get_detection_trends(
+            bucket=params.get('bucket', 'day'),
+            since=params.get('since'),
+            until=params.get('until'),
+            detection_type=params.get('type')
+        )
+    
+    try:
+        key = 'detections?' + '&'.join(f'{k}={params.get(k)}' for k in ('since', 'until', 'bucket', 'type'))
+        return cached_json(key, versions, build)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/api/detections/stream')
+def detection_stream():
+    """
+    Server-Sent Events feed of district states: all districts on connect,
+    then each district whose latest detection changes. Reconnecting clients
+    send Last-Event-ID and only get what they missed. Each response ends
+    after FAW_STREAM_SECONDS so it stays under the gunicorn worker timeout;
+    the browser reconnects a second later and picks up where it left off
+    """
+    event_id = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(event_stream(detector_adapter.detection_stream, event_id, STREAM_SECONDS, retry_ms=1000), headers=headers, mimetype='text/event-stream')
+
+@app.route('/api/detect_batch', methods=['POST'])
+def detect_batch():
+    """
+    Detect many images in one request and stream back one NDJSON line per image.
+    
+    Accepts multipart 'file'/'files' parts with an optional 'locations' field
+    (JSON keyed by file name, or a list in upload order), or a zip or tar
+    archive as the body or as the only file part, with an optional
+    locations.json inside. Images with coordinates are recorded like
+    /api/detect_with_location
+    """
+    request.max_content_length = BATCH_MAX_CONTENT_LENGTH
+    
+    kind = archive_kind(request.content_type)
+    if kind == 'tar':
+        # Read straight from the request as it arrives
+        items = items_from_archive(request.stream, kind)
+    elif kind == 'zip':
+        # Zip keeps its index at the end, so spool the body first
+        spool = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+        while True:
+            chunk = request.stream.read(1024 * 1024)
+            if not chunk:
+                break
+            spool.write(chunk)
+        spool.seek(0)
+        items = items_from_archive(spool, kind)
+    else:
+        files = request.files.getlist('file') + request.files.getlist('files')
+        if not files:
+            return jsonify({"error": "No files uploaded"}), 400
+        
+        # Flask closes the uploaded parts when the view returns, before the
+        # response streams, so take what the pipeline needs out of them now
+        file_kind = archive_kind(files[0].mimetype, files[0].filename) if len(files) == 1 else None
+        if file_kind:
+            spool = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+            shutil.copyfileobj(files[0].stream, spool)
+            spool.seek(0)
+            items = items_from_archive(spool, file_kind)
+        else:
+            try:
+                locations = parse_locations(request.form.get('locations'))
+            except ValueError as e:
+                return jsonify({"error": f"Invalid locations: {e}"}), 400
+            items = items_from_files([(f.filename, f.read()) for f in files], locations)
+    
+    lines = ndjson_lines(batch_detector.run(items))
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+@app.route('/api/ready')
+def ready():
+    """Readiness probe: 200 once the models are loaded and warmed up, 503 until then"""
+    if is_ready():
+        return jsonify({"ready": True})
+
+    # Kick off loading so a probe alone is enough to bring the worker up
+    start_loading()
+    return jsonify({"ready": False}), 503
+
+@app.route('/api/capabilities')
+def capabilities():
+    """Model input shapes and the preferred upload format, so clients can resize photos before sending them"""
+    if not is_ready():
+        start_loading()
+        return jsonify({"error": "Models are still loading"}), 503, {'Retry-After': '5'}
+    
+    detector = get_models()
+    return cached_json('capabilities', detector.model_version, lambda: describe_capabilities(
+        detector.get_input_shapes(), app.config['MAX_CONTENT_LENGTH']
+    ))
+
+@app.route('/api/stats')
+def get_stats():
+    """Get detection service metrics (pool wait times, batch sizes, recorder queue)"""
+    stats = {}
+    service = loaded_detection_service()
+    # Walk the chain of wrappers, e.g. BatchScheduler -> DetectorPool
+    while hasattr(service, 'get_stats'):
+        stats[type(service).__name__] = service.get_stats()
+        service = getattr(service, 'detector', None)
+    if detector_adapter.recorder is not None:
+        stats['DetectionRecorder'] = detector_adapter.recorder.get_stats()
+    stats['ResponseCache'] = http_cache.get_stats()
+    stats['DetectionBroker'] = detector_adapter.detection_stream.get_stats()
+    return jsonify(stats)
 
 @app.route('/api/detect_with_location', methods=['POST'])
 def detect_with_location():
@@ -91,8 +242,8 @@ def detect_with_location():
         latitude = float(data['latitude'])
         longitude = float(data['longitude'])
         
-        # Find the nearest district based on coordinates
-        district = detector_adapter.find_nearest_district(latitude, longitude)
+        # Find the district containing the coordinates
+        district = detector_adapter.find_district(latitude, longitude)
         
         if not district:
             return jsonify({"error": "Could not determine district from coordinates"}), 400
@@ -102,21 +253,61 @@ def detect_with_location():
         if 'data:image' in image_data:  # Handle data URI scheme
             image_data = image_data.split(',')[1]
         
-        # Save image to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as temp_file:
-            temp_file.write(base64.b64decode(image_data))
-            temp_path = temp_file.name
-        
-        # Run detection and record location
-        result = detector_adapter.detect_and_record(temp_path, district)
+        # Run detection on the decoded bytes and record location
+        result = detector_adapter.detect_and_record(base64.b64decode(image_data), district)
         
         # Add district information to the result
         result['district'] = district
         
-        # Clean up
-        os.remove(temp_path)
+        return jsonify(result)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/v2/detect_with_location', methods=['POST'])
+def detect_with_location_v2():
+    """
+    /api/detect_with_location without the base64 JSON envelope. Send either:
+    1. The image itself as the body (image/jpeg, application/octet-stream, ...)
+       with X-Latitude and X-Longitude headers (or latitude/longitude query parameters),
+       or raw RGB pixels as application/x-raw-rgb with X-Image-Width and X-Image-Height
+    2. A multipart form with a 'file' part and latitude/longitude fields
+    """
+    try:
+        if is_multipart(request.content_type):
+            file = request.files.get('file')
+            if file is None or file.filename == '':
+                return jsonify({"error": "No image data provided"}), 400
+            latitude, longitude = read_location(request.headers, request.form, request.args)
+            image_data = file.read()
+        else:
+            latitude, longitude = read_location(request.headers, request.args)
+            image_data = read_body(
+                request.stream, declared_length(request.headers.get('Content-Length')), app.config['MAX_CONTENT_LENGTH']
+            )
+            if is_raw_rgb(request.content_type):
+                # Pixels already at the model size go to inference without decoding
+                image_data = raw_rgb_image(image_data, request.headers)
+    except UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except (ValueError, IncompleteUpload) as e:
+        return jsonify({"error": str(e)}), 400
+    
+    if not len(image_data):
+        return jsonify({"error": "No image data provided"}), 400
+    
+    try:
+        district = detector_adapter.find_district(latitude, longitude)
+        if not district:
+            return jsonify({"error": "Could not determine district from coordinates"}), 400
+        
+        # The buffer goes to cv2.imdecode as is, without another copy
+        result = detector_adapter.detect_and_record(image_data, district)
+        result['district'] = district
         
         return jsonify(result)
+    except ValueError as e:
+        # The body is not an image cv2 can decode
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
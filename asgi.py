@@ -0,0 +1,358 @@
+"""
+ASGI variant of the endpoints in app.py, for serving with uvicorn:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000 --workers 2
+
+Request bodies are received asynchronously, so slow mobile uploads only
+cost an idle coroutine instead of a whole worker. Detection and database
+work run in a bounded thread pool sized by FAW_INFERENCE_THREADS. The JSON
+contracts are the same as the Flask app's.
+"""
+import asyncio
+import base64
+import contextlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from starlette.applications import Starlette
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from serving import detection_service, loaded_detection_service, start_loading, is_ready, get_models
+from map.detector_adapter import DetectorAdapter
+from map.http_cache import ResponseCache
+from map.detection_stream import event_stream_async, parse_event_id
+from batch_detection import BatchDetector, archive_kind, items_from_archive, items_from_files, parse_locations, ndjson_lines
+from request_body import (
+    UploadTooLarge, IncompleteUpload, declared_length, read_body_async, read_location, is_multipart, is_raw_rgb,
+    raw_rgb_image, describe_capabilities
+)
+from model_utils import IMG_SIZE
+
+UPLOAD_FOLDER = 'uploads'
+TEMPLATE_FOLDER = 'map/templates'
+MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max upload, as in app.py
+BATCH_MAX_CONTENT_LENGTH = int(float(os.environ.get('FAW_BATCH_UPLOAD_MB', '256')) * 1024 * 1024)
+
+# At most this many detections run at once; everything else waits as a
+# cheap coroutine. Database calls get their own small pool
+inference_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('FAW_INFERENCE_THREADS', os.environ.get('FAW_POOL_SIZE', '1'))),
+    thread_name_prefix='inference'
+)
+db_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='db')
+
+detector_adapter = DetectorAdapter(detection_service)
+http_cache = ResponseCache()
+batch_detector = BatchDetector(
+    detection_service, detector_adapter,
+    chunk_size=int(os.environ.get('FAW_BATCH_CHUNK_SIZE', '8')),
+    max_images=int(os.environ.get('FAW_BATCH_MAX_IMAGES', '200')),
+    # The armyworm model has the largest input, so decoding down to it loses nothing
+    decode_size=IMG_SIZE,
+    # An inference sidecar decodes the uploads itself; pixels would not fit its shared memory slots
+    decode=not os.environ.get('FAW_INFERENCE_SIDECAR')
+)
+
+
+async def run_in(executor, func, *args):
+    """Run a blocking call in one of the bounded pools"""
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+def cached_json(request, key, version, build):
+    """Serve JSON from the HTTP cache, answering If-None-Match with 304 and compressing for Accept-Encoding"""
+    status, body, headers = http_cache.respond(
+        key, version, build,
+        if_none_match=request.headers.get('if-none-match'),
+        accept_encoding=request.headers.get('accept-encoding')
+    )
+    return Response(body, status_code=status, headers=headers, media_type='application/json')
+
+
+def too_large(request, limit=MAX_CONTENT_LENGTH):
+    """Return a 413 response when the declared body is over the limit"""
+    content_length = request.headers.get('content-length')
+    if content_length and content_length.isdigit() and int(content_length) > limit:
+        return JSONResponse({"error": "Upload too large"}, status_code=413)
+    return None
+
+
+async def index(request):
+    """Serve the main page with the map"""
+    return FileResponse(os.path.join(TEMPLATE_FOLDER, 'index.html'))
+
+
+async def detect(request):
+    """Original detection endpoint without location tracking"""
+    rejection = too_large(request)
+    if rejection:
+        return rejection
+
+    form = await request.form()
+    file = form.get('file')
+
+    # Check if the file part is in the request
+    if file is None or not hasattr(file, 'filename'):
+        return JSONResponse({"error": "No file uploaded"}, status_code=400)
+
+    # Ensure that a file is uploaded
+    if file.filename == '':
+        return JSONResponse({"error": "No file selected"}, status_code=400)
+
+    try:
+        image_data = await file.read()
+        results = await run_in(inference_executor, detection_service.detect, image_data)
+        return JSONResponse(results)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def get_districts(request):
+    """Get all districts for the map"""
+    districts_version, _ = await run_in(db_executor, detector_adapter.get_data_versions)
+    return await run_in(
+        db_executor, cached_json, request, 'districts', districts_version, detector_adapter.get_all_districts
+    )
+
+
+async def get_detections(request):
+    """Latest detection per district, or counts per bucket when since/until/bucket/type are given"""
+    params = request.query_params
+    versions = await run_in(db_executor, detector_adapter.get_data_versions)
+    if not any(key in params for key in ('since', 'until', 'bucket', 'type')):
+        return await run_in(
+            db_executor, cached_json, request, 'detections', versions, detector_adapter.get_detection_map_data
+        )
+
+    def build():
+        return detector_adapter.get_detection_trends(
+            params.get('bucket', 'day'), params.get('since'), params.get('until'), params.get('type')
+        )
+
+    try:
+        key = 'detections?' + '&'.join(f'{k}={params.get(k)}' for k in ('since', 'until', 'bucket', 'type'))
+        return await run_in(db_executor, cached_json, request, key, versions, build)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+
+async def detection_stream(request):
+    """Server-Sent Events feed of district states, resumable with Last-Event-ID"""
+    event_id = parse_event_id(request.headers.get('last-event-id') or request.query_params.get('last_event_id'))
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return StreamingResponse(
+        event_stream_async(detector_adapter.detection_stream, event_id), headers=headers, media_type='text/event-stream'
+    )
+
+
+async def detect_with_location(request):
+    """Same contract as the Flask /api/detect_with_location endpoint"""
+    rejection = too_large(request)
+    if rejection:
+        return rejection
+
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+
+    # Check if all required data is provided
+    if not data:
+        return JSONResponse({"error": "No data provided"}, status_code=400)
+
+    # Check for image data
+    if 'image' not in data:
+        return JSONResponse({"error": "No image data provided"}, status_code=400)
+
+    # Check for location data
+    if 'latitude' not in data or 'longitude' not in data:
+        return JSONResponse({"error": "Location data (latitude and longitude) is required"}, status_code=400)
+
+    try:
+        latitude = float(data['latitude'])
+        longitude = float(data['longitude'])
+
+        district = await run_in(db_executor, detector_adapter.find_district, latitude, longitude)
+        if not district:
+            return JSONResponse({"error": "Could not determine district from coordinates"}, status_code=400)
+
+        image_data = data['image']
+        if 'data:image' in image_data:  # Handle data URI scheme
+            image_data = image_data.split(',')[1]
+
+        result = await run_in(
+            inference_executor, detector_adapter.detect_and_record, base64.b64decode(image_data), district
+        )
+        result['district'] = district
+
+        return JSONResponse(result)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def detect_with_location_v2(request):
+    """Same contract as the Flask /api/v2/detect_with_location endpoint: a raw or multipart image body"""
+    rejection = too_large(request)
+    if rejection:
+        return rejection
+
+    try:
+        if is_multipart(request.headers.get('content-type')):
+            form = await request.form()
+            file = form.get('file')
+            if file is None or not hasattr(file, 'filename') or file.filename == '':
+                return JSONResponse({"error": "No image data provided"}, status_code=400)
+            latitude, longitude = read_location(request.headers, form, request.query_params)
+            image_data = await file.read()
+        else:
+            latitude, longitude = read_location(request.headers, request.query_params)
+            image_data = await read_body_async(
+                request.stream(), declared_length(request.headers.get('content-length')), MAX_CONTENT_LENGTH
+            )
+            if is_raw_rgb(request.headers.get('content-type')):
+                image_data = raw_rgb_image(image_data, request.headers)
+    except UploadTooLarge as e:
+        return JSONResponse({"error": str(e)}, status_code=413)
+    except (ValueError, IncompleteUpload) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    if not len(image_data):
+        return JSONResponse({"error": "No image data provided"}, status_code=400)
+
+    try:
+        district = await run_in(db_executor, detector_adapter.find_district, latitude, longitude)
+        if not district:
+            return JSONResponse({"error": "Could not determine district from coordinates"}, status_code=400)
+
+        result = await run_in(inference_executor, detector_adapter.detect_and_record, image_data, district)
+        result['district'] = district
+
+        return JSONResponse(result)
+    except ValueError as e:
+        # The body is not an image cv2 can decode
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+
+async def detect_batch(request):
+    """Same contract as the Flask /api/detect_batch endpoint: one NDJSON line per image"""
+    rejection = too_large(request, BATCH_MAX_CONTENT_LENGTH)
+    if rejection:
+        return rejection
+
+    kind = archive_kind(request.headers.get('content-type'))
+    if kind:
+        # Receive the archive without holding a thread, then read it in the pool
+        spool = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+        received = 0
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > BATCH_MAX_CONTENT_LENGTH:
+                return JSONResponse({"error": "Upload too large"}, status_code=413)
+            spool.write(chunk)
+        spool.seek(0)
+        items = items_from_archive(spool, kind)
+    else:
+        form = await request.form()
+        files = [f for f in form.getlist('file') + form.getlist('files') if hasattr(f, 'filename')]
+        if not files:
+            return JSONResponse({"error": "No files uploaded"}, status_code=400)
+
+        file_kind = archive_kind(files[0].content_type, files[0].filename) if len(files) == 1 else None
+        if file_kind:
+            items = items_from_archive(files[0].file, file_kind)
+        else:
+            try:
+                locations = parse_locations(form.get('locations'))
+            except ValueError as e:
+                return JSONResponse({"error": f"Invalid locations: {e}"}, status_code=400)
+            items = items_from_files(((f.filename, f.file.read()) for f in files), locations)
+
+    lines = ndjson_lines(batch_detector.run(items))
+
+    async def stream():
+        # Each step of the pipeline runs in the bounded inference pool
+        while True:
+            line = await run_in(inference_executor, next, lines, None)
+            if line is None:
+                break
+            yield line
+
+    return StreamingResponse(stream(), media_type='application/x-ndjson')
+
+
+async def capabilities(request):
+    """Same contract as the Flask /api/capabilities endpoint"""
+    if not is_ready():
+        start_loading()
+        return JSONResponse({"error": "Models are still loading"}, status_code=503, headers={'Retry-After': '5'})
+
+    detector = get_models()
+    return await run_in(
+        db_executor, cached_json, request, 'capabilities', detector.model_version,
+        lambda: describe_capabilities(detector.get_input_shapes(), MAX_CONTENT_LENGTH)
+    )
+
+
+async def ready(request):
+    """Readiness probe: 200 once the models are loaded and warmed up, 503 until then"""
+    if is_ready():
+        return JSONResponse({"ready": True})
+
+    start_loading()
+    return JSONResponse({"ready": False}, status_code=503)
+
+
+async def get_stats(request):
+    """Get detection service metrics (pool wait times, batch sizes, recorder queue)"""
+    stats = {}
+    service = loaded_detection_service()
+    while hasattr(service, 'get_stats'):
+        stats[type(service).__name__] = service.get_stats()
+        service = getattr(service, 'detector', None)
+    if detector_adapter.recorder is not None:
+        stats['DetectionRecorder'] = detector_adapter.recorder.get_stats()
+    stats['ResponseCache'] = http_cache.get_stats()
+    stats['DetectionBroker'] = detector_adapter.detection_stream.get_stats()
+    return JSONResponse(stats)
+
+
+async def uploaded_file(request):
+    """Serve uploaded files"""
+    filename = os.path.basename(request.path_params['filename'])
+    path = os.path.join(UPLOAD_FOLDER, filename)
+    if not os.path.isfile(path):
+        return JSONResponse({"error": "File not found"}, status_code=404)
+    return FileResponse(path)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Load the models in the background as soon as the worker starts"""
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    start_loading()
+    yield
+    inference_executor.shutdown(wait=True)
+    db_executor.shutdown(wait=True)
+    # Write out any detections still queued by the background recorder
+    detector_adapter.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/', index),
+        Route('/detect', detect, methods=['POST']),
+        Route('/api/districts', get_districts),
+        Route('/api/detections', get_detections),
+        Route('/api/detections/stream', detection_stream),
+        Route('/api/detect_with_location', detect_with_location, methods=['POST']),
+        Route('/api/v2/detect_with_location', detect_with_location_v2, methods=['POST']),
+        Route('/api/detect_batch', detect_batch, methods=['POST']),
+        Route('/api/capabilities', capabilities),
+        Route('/api/ready', ready),
+        Route('/api/stats', get_stats),
+        Route('/uploads/{filename}', uploaded_file),
+    ],
+    lifespan=lifespan
+)
@@ -0,0 +1,239 @@
+import json
+import os
+import tarfile
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from image_utils import load_image
+
+# Optional archive member with coordinates: {"name.jpg": {"latitude": .., "longitude": ..}}
+LOCATIONS_FILE = "locations.json"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+ARCHIVE_TYPES = {
+    "application/zip": "zip",
+    "application/x-zip-compressed": "zip",
+    "application/x-tar": "tar",
+    "application/gzip": "tar",
+    "application/x-gzip": "tar",
+    "application/x-gtar": "tar",
+}
+
+
+class BatchItem:
+    """One uploaded image with its optional coordinates"""
+    def __init__(self, name, data, latitude=None, longitude=None):
+        self.name = name
+        self.data = data
+        self.latitude = latitude
+        self.longitude = longitude
+
+
+def archive_kind(content_type=None, filename=None):
+    """Return 'zip' or 'tar' when a content type or filename names an archive, else None"""
+    if content_type and content_type.split(";")[0].strip().lower() in ARCHIVE_TYPES:
+        return ARCHIVE_TYPES[content_type.split(";")[0].strip().lower()]
+    name = (filename or "").lower()
+    if name.endswith(".zip"):
+        return "zip"
+    if name.endswith((".tar", ".tar.gz", ".tgz")):
+        return "tar"
+    return None
+
+
+def parse_locations(value):
+    """Parse a locations JSON document: an object keyed by file name or a list in upload order"""
+    if not value:
+        return {}
+    locations = json.loads(value) if isinstance(value, (str, bytes)) else value
+    if not isinstance(locations, (dict, list)):
+        raise ValueError("locations must be a JSON object keyed by file name or a list")
+    return locations
+
+
+def location_for(locations, index, name):
+    """Look up (latitude, longitude) for an image, (None, None) when it has none"""
+    if isinstance(locations, list):
+        entry = locations[index] if index < len(locations) else None
+    else:
+        entry = locations.get(name) or locations.get(os.path.basename(name))
+    if not entry:
+        return None, None
+    return float(entry["latitude"]), float(entry["longitude"])
+
+
+def items_from_files(files, locations=None):
+    """Turn (name, bytes) pairs from a multipart upload into BatchItems"""
+    locations = parse_locations(locations)
+    for index, (name, data) in enumerate(files):
+        latitude, longitude = location_for(locations, index, name)
+        yield BatchItem(name, data, latitude, longitude)
+
+
+def is_image_member(name):
+    """Skip directories, hidden files and anything that is not an image"""
+    base = os.path.basename(name)
+    return not base.startswith(".") and base.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def items_from_tar(fileobj):
+    """
+    Read images from a tar (optionally gzipped) stream as it arrives.
+
+    The archive is read sequentially, so a locations.json member only
+    applies to the images after it; put it first.
+    """
+    locations = {}
+    index = 0
+    with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            if os.path.basename(member.name) == LOCATIONS_FILE:
+                locations = parse_locations(archive.extractfile(member).read())
+                continue
+            if not is_image_member(member.name):
+                continue
+            data = archive.extractfile(member).read()
+            latitude, longitude = location_for(locations, index, member.name)
+            yield BatchItem(member.name, data, latitude, longitude)
+            index += 1
+
+
+def items_from_zip(fileobj):
+    """Read images from a zip archive; zip needs a seekable file"""
+    with zipfile.ZipFile(fileobj) as archive:
+        names = archive.namelist()
+        location_names = [name for name in names if os.path.basename(name) == LOCATIONS_FILE]
+        locations = parse_locations(archive.read(location_names[0])) if location_names else {}
+
+        index = 0
+        for name in names:
+            if name.endswith("/") or not is_image_member(name):
+                continue
+            latitude, longitude = location_for(locations, index, name)
+            yield BatchItem(name, archive.read(name), latitude, longitude)
+            index += 1
+
+
+def items_from_archive(fileobj, kind):
+    """Dispatch to the tar or zip reader"""
+    return items_from_zip(fileobj) if kind == "zip" else items_from_tar(fileobj)
+
+
+class BatchDetector:
+    """
+    Runs a stream of uploaded images through detection as a pipeline.
+
+    While one chunk is in inference the decode pool is already decoding the
+    next, and the upload itself is read lazily as items are pulled, so
+    reading, decoding, inference and recording overlap. Each chunk goes to
+    the detection service's detect_batch(), so a BatchScheduler or
+    DetectorPool behind it sees whole batches. Results come out in upload
+    order, one dict per image. With decode=False the encoded uploads are
+    passed on as they are, e.g. to an inference sidecar that decodes them
+    itself instead of receiving full pixel arrays.
+    """
+    def __init__(self, detection_service, adapter=None, chunk_size=8, decode_workers=2, max_images=200, decode_size=None,
+                 decode=True):
+        self.detection_service = detection_service
+        self.adapter = adapter
+        self.chunk_size = chunk_size
+        self.max_images = max_images
+        # Large JPEGs are decoded at reduced resolution down to this size
+        self.decode_size = decode_size
+        self.decode = decode
+        self.decoder = ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix="batch-decode")
+
+    def run(self, items):
+        """Yield one result dict per item as its chunk finishes"""
+        pending = deque()
+        count = 0
+        stopped = None
+        items = iter(items)
+        while True:
+            try:
+                item = next(items)
+            except StopIteration:
+                break
+            except Exception as e:
+                # A corrupt archive or bad locations document ends the batch, keeping what was read
+                stopped = {"error": f"Could not read upload: {e}"}
+                break
+
+            if count == self.max_images:
+                stopped = {"error": f"Batch limit of {self.max_images} images reached, remaining images were skipped"}
+                break
+
+            if self.decode:
+                # cv2.imdecode releases the GIL, so decoding runs alongside inference
+                future = self.decoder.submit(load_image, item.data, self.decode_size)
+            else:
+                future = Future()
+                future.set_result(item.data)
+            pending.append((count, item, future))
+            count += 1
+            if len(pending) >= 2 * self.chunk_size:
+                yield from self.run_chunk([pending.popleft() for _ in range(self.chunk_size)])
+
+        while pending:
+            yield from self.run_chunk([pending.popleft() for _ in range(min(self.chunk_size, len(pending)))])
+
+        if stopped is not None:
+            yield stopped
+
+    def run_chunk(self, chunk):
+        """Detect and record one chunk of (index, item, decode future) entries"""
+        results = {}
+        decoded = []
+        for index, item, future in chunk:
+            try:
+                decoded.append((index, item, future.result()))
+            except Exception as e:
+                results[index] = {"error": f"Could not decode image: {e}"}
+
+        if decoded:
+            images = [image for _, _, image in decoded]
+            try:
+                detections = self.detection_service.detect_batch(images)
+            except Exception:
+                # Retry one by one so a single bad image does not fail the rest
+                detections = []
+                for image in images:
+                    try:
+                        detections.append(self.detection_service.detect(image))
+                    except Exception as e:
+                        detections.append({"error": str(e)})
+
+            for (index, item, _), detection in zip(decoded, detections):
+                results[index] = self.record(item, detection)
+
+        for index, item, _ in chunk:
+            result = dict(results[index])
+            result["index"] = index
+            result["filename"] = item.name
+            yield result
+
+    def record(self, item, detection):
+        """Resolve the district and record the detection when the image came with coordinates"""
+        if "error" in detection or self.adapter is None or item.latitude is None:
+            return detection
+
+        result = dict(detection)
+        try:
+            district = self.adapter.find_district(item.latitude, item.longitude)
+            if district:
+                self.adapter.record_detection(detection, district)
+            result["district"] = district
+        except Exception as e:
+            result["record_error"] = str(e)
+        return result
+
+    def close(self):
+        """Stop the decode threads"""
+        self.decoder.shutdown(wait=True)
+
+
+def ndjson_lines(results):
+    """Serialise result dicts as newline-delimited JSON"""
+    for result in results:
+        yield json.dumps(result) + "\n"
@@ -0,0 +1,131 @@
+import queue
+import threading
+import time
+
+
+class PendingDetection:
+    """A single caller waiting for its image to go through a batch"""
+    def __init__(self, image):
+        self.image = image
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class BatchScheduler:
+    """
+    Collects detection requests that arrive within a few milliseconds of each
+    other and runs them through the detector as one batch.
+
+    Callers use detect() exactly like FallArmywormDetector.detect() and each
+    get their own result dict back. Batching only helps when requests arrive
+    concurrently, e.g. gunicorn with --threads.
+    """
+    def __init__(self, detector, max_batch_size=8, max_wait_ms=5, workers=1):
+        self.detector = detector
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.batches_run = 0
+        self.images_processed = 0
+
+        # One scheduler thread per interpreter so a DetectorPool can run batches in parallel
+        self.threads = []
+        for n in range(workers):
+            thread = threading.Thread(target=self.run, name=f"batch-scheduler-{n}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def detect(self, image):
+        """Queue an image for the next batch and wait for its result"""
+        pending = PendingDetection(image)
+        self.queue.put(pending)
+        pending.done.wait()
+
+        if pending.error is not None:
+            raise pending.error
+
+        return pending.result
+
+    def detect_batch(self, images):
+        """Run a batch the caller has already collected"""
+        pending = [PendingDetection(image) for image in images]
+        for item in pending:
+            self.queue.put(item)
+
+        results = []
+        for item in pending:
+            item.done.wait()
+            if item.error is not None:
+                raise item.error
+            results.append(item.result)
+
+        return results
+
+    def run(self):
+        """Scheduler loop: wait for a first request, then fill the batch until it is full or the wait expires"""
+        while True:
+            first = self.queue.get()
+            if first is None:
+                break
+
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Put the stop marker back so the outer loop exits after this batch
+                    self.queue.put(None)
+                    break
+                batch.append(item)
+
+            self.process_batch(batch)
+
+    def process_batch(self, batch):
+        """Run one batch and hand each caller its result"""
+        try:
+            results = self.detector.detect_batch([item.image for item in batch])
+            for item, result in zip(batch, results):
+                item.result = result
+        except Exception:
+            # One bad image should not fail the whole batch, so retry each image on its own
+            for item in batch:
+                try:
+                    item.result = self.detector.detect(item.image)
+                except Exception as e:
+                    item.error = e
+
+        with self.lock:
+            self.batches_run += 1
+            self.images_processed += len(batch)
+
+        for item in batch:
+            item.done.set()
+
+    def get_stats(self):
+        """Return batching statistics"""
+        with self.lock:
+            batches_run = self.batches_run
+            images_processed = self.images_processed
+
+        return {
+            "batches_run": batches_run,
+            "images_processed": images_processed,
+            "average_batch_size": images_processed / batches_run if batches_run else 0.0,
+            "queue_depth": self.queue.qsize()
+        }
+
+    def close(self):
+        """Stop the scheduler threads once queued requests are done"""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
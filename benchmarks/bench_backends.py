@@ -0,0 +1,99 @@
+"""
+Compare the inference backends on the two shipped models.
+
+Each backend runs in a fresh interpreter with FAW_INFERENCE_BACKEND set,
+and the script reports:
+- import: time to import the runtime
+- load: time to create and allocate interpreters for both models
+- first/steady: the first invoke of both models, then the median of the rest
+- RSS: peak resident memory of the process
+Backends that are not installed are listed as such.
+
+    python benchmarks/bench_backends.py --repeat 50
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE = '''
+import json, os, resource, sys, time
+sys.path.insert(0, os.getcwd())
+import numpy as np
+
+started = time.monotonic()
+try:
+    from inference_backend import load_tflite, create_interpreter
+    load_tflite()
+except ImportError as e:
+    print(json.dumps({"error": str(e)}))
+    sys.exit(0)
+import_s = time.monotonic() - started
+
+started = time.monotonic()
+interpreters = [create_interpreter("maizeleafclassifier2_metadata.tflite"), create_interpreter("fall_armyworm_detector.tflite")]
+load_s = time.monotonic() - started
+
+def invoke_all():
+    for interpreter in interpreters:
+        detail = interpreter.get_input_details()[0]
+        interpreter.set_tensor(detail["index"], np.zeros(detail["shape"], dtype=detail["dtype"]))
+        interpreter.invoke()
+
+started = time.perf_counter()
+invoke_all()
+first_ms = (time.perf_counter() - started) * 1000
+
+timings = []
+for _ in range(int(sys.argv[1])):
+    started = time.perf_counter()
+    invoke_all()
+    timings.append((time.perf_counter() - started) * 1000)
+timings.sort()
+
+print(json.dumps({
+    "import_s": import_s,
+    "load_s": load_s,
+    "first_ms": first_ms,
+    "steady_ms": timings[len(timings) // 2],
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+}))
+'''
+
+
+def run(backend, repeat):
+    """Measure one backend in a fresh interpreter and return its JSON result"""
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL="3", FAW_INFERENCE_BACKEND=backend)
+    output = subprocess.run(
+        [sys.executable, "-c", MEASURE, str(repeat)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    sys.path.insert(0, ROOT)
+    from inference_backend import BACKENDS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20, help="invokes timed after the first")
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    args = parser.parse_args()
+
+    print(f"{'backend':>15} {'import s':>9} {'load s':>7} {'first ms':>9} {'steady ms':>10} {'RSS MB':>8}")
+    for backend in args.backends.split(","):
+        result = run(backend, args.repeat)
+        if "error" in result:
+            print(f"{backend:>15}  not installed ({result['error']})")
+            continue
+        print(
+            f"{backend:>15} {result['import_s']:>9.2f} {result['load_s']:>7.2f} {result['first_ms']:>9.1f}"
+            f" {result['steady_ms']:>10.1f} {result['rss_mb']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark detection throughput with the micro-batching scheduler.
+
+Runs concurrent client threads against a BatchScheduler for each max batch
+size and prints requests/sec. Run from anywhere:
+
+    python benchmarks/bench_batching.py --duration 10
+"""
+import argparse
+import glob
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # Model and class map paths are relative to the repo root
+
+from model_utils import get_detector
+from batching import BatchScheduler
+
+
+def run_clients(service, images, num_clients, duration):
+    """Hammer the service from num_clients threads and return completed requests"""
+    completed = [0] * num_clients
+    stop_at = time.monotonic() + duration
+
+    def client(n):
+        i = n
+        while time.monotonic() < stop_at:
+            service.detect(images[i % len(images)])
+            completed[n] += 1
+            i += 1
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(num_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return sum(completed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per batch size")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--batch-sizes", default="1,4,8,16")
+    parser.add_argument("--images", default="uploads/*.jp*g")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(args.images))
+    if not paths:
+        sys.exit(f"No images match {args.images}")
+
+    # Keep the encoded bytes in memory, like request bodies
+    images = []
+    for path in paths:
+        with open(path, "rb") as f:
+            images.append(f.read())
+
+    # Warm up every interpreter before timing anything
+    detector = get_detector()
+    detector.warmup(max(int(size) for size in args.batch_sizes.split(",")))
+
+    print(f"{'batch size':>10} {'clients':>8} {'req/s':>10} {'avg batch':>10}")
+    for batch_size in [int(size) for size in args.batch_sizes.split(",")]:
+        scheduler = BatchScheduler(detector, max_batch_size=batch_size, max_wait_ms=args.max_wait_ms)
+        # Twice as many clients as batch slots keeps the queue full
+        num_clients = batch_size * 2
+        completed = run_clients(scheduler, images, num_clients, args.duration)
+        stats = scheduler.get_stats()
+        scheduler.close()
+
+        print(f"{batch_size:>10} {num_clients:>8} {completed / args.duration:>10.1f} {stats['average_batch_size']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark point-in-polygon district lookups.
+
+Uses the GeoJSON boundary file when it exists, otherwise a synthetic
+tessellation of Uganda's extent into as many irregular districts as the
+real country has. Random points across the whole extent are resolved one at
+a time (as the upload endpoint does), in one batch call, and by testing
+every polygon without the grid, and lookups/sec are printed for each.
+
+    python benchmarks/bench_district_lookup.py --points 20000
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from map.district_boundaries import DistrictBoundaries, DistrictShape, DEFAULT_BOUNDARIES_PATH
+
+# Approximate bounding box of Uganda
+MIN_LON, MAX_LON = 29.5, 35.0
+MIN_LAT, MAX_LAT = -1.5, 4.3
+
+
+def synthetic_shapes(columns, rows, vertices_per_edge, seed=0):
+    """Tile the extent with quadrilaterals whose shared corners are jittered, densified like real borders"""
+    rng = np.random.default_rng(seed)
+    xs = np.linspace(MIN_LON, MAX_LON, columns + 1)
+    ys = np.linspace(MIN_LAT, MAX_LAT, rows + 1)
+    corners = np.stack(np.meshgrid(xs, ys, indexing='ij'), axis=-1)
+
+    # Jitter interior corners only, so the tiles still cover the whole extent
+    jitter = (rng.random(corners.shape) - 0.5) * 0.6
+    jitter *= [(xs[1] - xs[0]), (ys[1] - ys[0])]
+    corners[1:-1, 1:-1] += jitter[1:-1, 1:-1]
+
+    steps = np.linspace(0.0, 1.0, vertices_per_edge, endpoint=False)[:, None]
+    shapes = []
+    for column in range(columns):
+        for row in range(rows):
+            quad = [corners[column, row], corners[column + 1, row], corners[column + 1, row + 1], corners[column, row + 1]]
+            ring = np.concatenate([a + steps * (b - a) for a, b in zip(quad, quad[1:] + quad[:1])])
+            shapes.append(DistrictShape(f"District {column}-{row}", [ring]))
+    return shapes
+
+
+def brute_force(shapes, latitudes, longitudes):
+    """Test every polygon for every point, as a lookup without a spatial index would"""
+    names = np.full(len(latitudes), None, dtype=object)
+    for shape in shapes:
+        pending = np.flatnonzero(names == None)  # noqa: E711
+        inside = shape.contains(longitudes[pending], latitudes[pending])
+        names[pending[inside]] = shape.name
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--boundaries", default=os.environ.get("FAW_DISTRICT_BOUNDARIES", DEFAULT_BOUNDARIES_PATH))
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--cell-size", type=float, default=0.1, help="grid cell size in degrees")
+    parser.add_argument("--vertices-per-edge", type=int, default=50, help="synthetic polygons only")
+    args = parser.parse_args()
+
+    if os.path.exists(args.boundaries):
+        boundaries = DistrictBoundaries.from_geojson(args.boundaries, cell_size=args.cell_size)
+        source = args.boundaries
+    else:
+        # 135 districts, as in populate_districts.py
+        boundaries = DistrictBoundaries(synthetic_shapes(15, 9, args.vertices_per_edge), cell_size=args.cell_size)
+        source = "synthetic"
+
+    edges = sum(len(shape.x1) for shape in boundaries.shapes)
+    print(f"{len(boundaries.shapes)} districts ({source}), {edges} edges, {len(boundaries.grid)} grid cells")
+
+    rng = np.random.default_rng(1)
+    latitudes = rng.uniform(MIN_LAT, MAX_LAT, args.points)
+    longitudes = rng.uniform(MIN_LON, MAX_LON, args.points)
+
+    started = time.perf_counter()
+    single = [boundaries.find_district(lat, lon) for lat, lon in zip(latitudes, longitudes)]
+    single_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batch = boundaries.lookup(latitudes, longitudes)
+    batch_s = time.perf_counter() - started
+
+    # Brute force is slow, so time it on a sample
+    sample = min(args.points, 2000)
+    started = time.perf_counter()
+    reference = brute_force(boundaries.shapes, latitudes[:sample], longitudes[:sample])
+    brute_s = time.perf_counter() - started
+
+    mismatches = sum(a != b for a, b in zip(single[:sample], reference)) + sum(a != b for a, b in zip(single, batch))
+    print(f"{'mode':>12} {'lookups/s':>12} {'us/lookup':>10}")
+    for mode, count, seconds in [
+        ("single", args.points, single_s),
+        ("batch", args.points, batch_s),
+        ("brute force", sample, brute_s)
+    ]:
+        print(f"{mode:>12} {count / seconds:>12.0f} {seconds / count * 1e6:>10.1f}")
+    print(f"mismatches: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Benchmark the map's latest-detection-per-district query as history grows.
+
+For each size a scratch database gets that many detections spread over a
+year across every district. The script then times:
+- cte: the old MAX(timestamp) GROUP BY query over the whole table
+- cte+index: the same query with the (district_id, timestamp) index
+- table: reading the trigger-maintained latest_detection table, as
+  /api/detections now does
+It also reports the per-row cost the triggers add to inserts.
+
+    python benchmarks/bench_latest_detections.py --sizes 10000,1000000,10000000
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from map.database_schema import DetectionDatabase
+
+OLD_QUERY = '''
+WITH LatestDetections AS (
+    SELECT district_id, MAX(timestamp) as latest_timestamp
+    FROM detections
+    GROUP BY district_id
+)
+SELECT districts.name, districts.latitude, districts.longitude,
+       detections.detection_type, detections.confidence, detections.timestamp
+FROM detections
+JOIN LatestDetections ON
+    detections.district_id = LatestDetections.district_id AND
+    detections.timestamp = LatestDetections.latest_timestamp
+JOIN districts ON detections.district_id = districts.id
+'''
+
+# One row per second over about a year, random district and type
+FILL = '''
+WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+INSERT INTO detections (district_id, detection_type, confidence, timestamp)
+SELECT
+    ? + abs(random()) % ?,
+    CASE abs(random()) % 4
+        WHEN 0 THEN 'fall-armyworm-larval-damage' WHEN 1 THEN 'fall-armyworm-egg'
+        WHEN 2 THEN 'fall-armyworm-frass' ELSE 'healthy-maize' END,
+    abs(random()) % 1000 / 1000.0,
+    datetime('2025-01-01', '+' || (abs(random()) % 31536000) || ' seconds')
+FROM n
+'''
+
+
+def time_query(conn, query, repeat):
+    """Best-of-repeat wall time of a query, in milliseconds"""
+    best = float("inf")
+    rows = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = len(conn.execute(query).fetchall())
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, rows
+
+
+def build(path, size):
+    """Create a database with all districts and size detections, and return a connection to it"""
+    from map.populate_districts import populate_uganda_districts
+
+    db = DetectionDatabase(path)
+    db.close()
+    populate_uganda_districts(path)
+
+    conn = sqlite3.connect(path)
+    # populate_uganda_districts inserts the districts with consecutive ids
+    first_id, district_count = conn.execute("SELECT MIN(id), COUNT(*) FROM districts").fetchone()
+
+    # Bulk load without the index and triggers, then rebuild as a migration would
+    conn.execute("DROP INDEX idx_detections_district_timestamp")
+    conn.execute("DROP TRIGGER latest_detection_insert")
+    started = time.perf_counter()
+    conn.execute(FILL, (size, first_id, district_count))
+    conn.commit()
+    print(f"  loaded {size} rows in {time.perf_counter() - started:.1f}s")
+    return conn
+
+
+def timed(func):
+    """Wall time of one call, in seconds"""
+    started = time.perf_counter()
+    func()
+    return time.perf_counter() - started
+
+
+def insert_overhead(count):
+    """Per-row insert time in microseconds, without and with the index and triggers"""
+    timings = []
+    for keep_triggers in (False, True):
+        with tempfile.TemporaryDirectory() as scratch:
+            db = DetectionDatabase(os.path.join(scratch, "insert.db"))
+            conn = db.connection()
+            if not keep_triggers:
+                conn.execute("DROP INDEX idx_detections_district_timestamp")
+                conn.execute("DROP TRIGGER latest_detection_insert")
+            rows = [(1 + n % 5, "healthy-maize", 0.5, f"2025-01-01 00:00:{n % 60:02d}") for n in range(count)]
+            started = time.perf_counter()
+            db.add_detection_rows(rows)
+            timings.append((time.perf_counter() - started) / count * 1e6)
+            db.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,1000000,10000000")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--inserts", type=int, default=20000, help="rows used to time insert overhead")
+    args = parser.parse_args()
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(",")]:
+        print(f"{size} detections")
+        with tempfile.TemporaryDirectory() as scratch:
+            path = os.path.join(scratch, "bench.db")
+            conn = build(path, size)
+
+            cte_ms, cte_rows = time_query(conn, OLD_QUERY, args.repeat)
+
+            started = time.perf_counter()
+            conn.close()
+            # Reopening recreates the index and triggers and backfills latest_detection
+            db = DetectionDatabase(path)
+            migrate_s = time.perf_counter() - started
+            conn = db.connection()
+            conn.execute("ANALYZE")
+
+            indexed_ms, _ = time_query(conn, OLD_QUERY, args.repeat)
+            table_ms = min(
+                timed(db.get_latest_detections_by_district) for _ in range(args.repeat)
+            ) * 1000
+            table_rows = len(db.get_latest_detections_by_district())
+            db.close()
+
+        results.append((size, cte_ms, indexed_ms, table_ms, cte_rows, table_rows, migrate_s))
+
+    insert_plain, insert_triggers = insert_overhead(args.inserts)
+
+    print()
+    print(f"{'rows':>10} {'cte ms':>10} {'cte+index ms':>13} {'table ms':>9} {'cte rows':>9} {'table rows':>11} {'backfill s':>11}")
+    for size, cte_ms, indexed_ms, table_ms, cte_rows, table_rows, migrate_s in results:
+        print(f"{size:>10} {cte_ms:>10.1f} {indexed_ms:>13.1f} {table_ms:>9.2f} {cte_rows:>9} {table_rows:>11} {migrate_s:>11.1f}")
+    print()
+    print(f"insert cost: {insert_plain:.1f}us/row without index and triggers, {insert_triggers:.1f}us/row with them")
+
+
+if __name__ == "__main__":
+    main()
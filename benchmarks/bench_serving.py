@@ -0,0 +1,158 @@
+"""
+Compare the Flask/gunicorn deployment with the ASGI/uvicorn one under slow uploads.
+
+For each server the benchmark opens --slow-clients connections that
+trickle a multipart upload to /detect a few bytes at a time, like phones on
+a poor link, and meanwhile measures how many normal /detect requests
+--fast-clients can complete and at what latency.
+
+    python benchmarks/bench_serving.py --workers 2 --slow-clients 50 --duration 20
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import threading
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOUNDARY = "benchboundary"
+
+
+def multipart_body(image_data):
+    """Encode an image as the multipart body /detect expects"""
+    head = (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="image.jpg"\r\n'
+        "Content-Type: image/jpeg\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{BOUNDARY}--\r\n".encode()
+    return head + image_data + tail
+
+
+def post_detect(port, body, chunk_size=None, chunk_delay=0.0, stop=None):
+    """POST a multipart body over a raw socket, optionally trickling it, and return the status line"""
+    sock = socket.create_connection(("127.0.0.1", port), timeout=120)
+    try:
+        sock.sendall((
+            "POST /detect HTTP/1.1\r\n"
+            f"Host: 127.0.0.1:{port}\r\n"
+            f"Content-Type: multipart/form-data; boundary={BOUNDARY}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode())
+
+        if chunk_size is None:
+            sock.sendall(body)
+        else:
+            for offset in range(0, len(body), chunk_size):
+                if stop is not None and stop.is_set():
+                    return None
+                sock.sendall(body[offset:offset + chunk_size])
+                time.sleep(chunk_delay)
+
+        response = b""
+        while b"\r\n" not in response:
+            data = sock.recv(4096)
+            if not data:
+                break
+            response += data
+        return response.split(b"\r\n", 1)[0].decode()
+    finally:
+        sock.close()
+
+
+def wait_until_ready(port, timeout=120):
+    """Poll /api/ready until the server's models are warmed up"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/ready", timeout=2) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Server on port {port} did not become ready")
+
+
+def run_load(port, body, args):
+    """Run slow and fast clients together and return fast-request latencies"""
+    stop = threading.Event()
+    latencies = []
+    errors = [0]
+
+    def slow_client():
+        while not stop.is_set():
+            try:
+                post_detect(port, body, chunk_size=args.chunk_size, chunk_delay=args.chunk_delay, stop=stop)
+            except OSError:
+                pass
+
+    def fast_client():
+        while not stop.is_set():
+            started = time.monotonic()
+            try:
+                status = post_detect(port, body)
+                if status and " 200 " in status:
+                    latencies.append(time.monotonic() - started)
+                else:
+                    errors[0] += 1
+            except OSError:
+                errors[0] += 1
+
+    threads = [threading.Thread(target=slow_client, daemon=True) for _ in range(args.slow_clients)]
+    threads += [threading.Thread(target=fast_client, daemon=True) for _ in range(args.fast_clients)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+
+    return latencies, errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--slow-clients", type=int, default=50)
+    parser.add_argument("--fast-clients", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=1024, help="bytes per slow-client send")
+    parser.add_argument("--chunk-delay", type=float, default=0.05, help="seconds between slow-client sends")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--image", default=os.path.join(ROOT, "uploads", "1.jpeg"))
+    args = parser.parse_args()
+
+    with open(args.image, "rb") as f:
+        body = multipart_body(f.read())
+
+    servers = [
+        ("flask/gunicorn", 8601, ["gunicorn", "-c", "gunicorn.conf.py", "-w", str(args.workers), "app:app"]),
+        ("asgi/uvicorn", 8602, ["uvicorn", "asgi:app", "--port", "8602", "--workers", str(args.workers)]),
+    ]
+
+    print(f"{'server':>16} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+    for name, port, command in servers:
+        # Every request reuses the same image, so turn the result cache off to measure inference
+        env = dict(os.environ, PORT=str(port), TF_CPP_MIN_LOG_LEVEL="3", FAW_RESULT_CACHE_MB="0")
+        server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            # Each worker loads its own models; hit /api/ready until one answers ready
+            wait_until_ready(port)
+            latencies, errors = run_load(port, body, args)
+        finally:
+            server.terminate()
+            server.wait()
+
+        if latencies:
+            latencies.sort()
+            p50 = statistics.median(latencies) * 1000
+            p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+        else:
+            p50 = p95 = float("nan")
+        print(f"{name:>16} {len(latencies) / args.duration:>8.1f} {p50:>8.0f} {p95:>8.0f} {errors:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Measure worker boot time and memory for the different startup modes.
+
+Each mode runs in a fresh interpreter:
+- lazy: import the app only, as a gunicorn master or a /api/districts-only worker does
+- eager: import the app and load + warm up the models, as every worker did before
+- forked: import TensorFlow in a parent, fork workers that each load the
+  models, and report their proportional set size (shared pages split
+  between the processes that map them)
+
+    python benchmarks/bench_startup.py --workers 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE = '''
+import json, os, resource, sys, time
+sys.path.insert(0, os.getcwd())
+
+def memory():
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    pss_kb = None
+    if os.path.exists("/proc/self/smaps_rollup"):
+        for line in open("/proc/self/smaps_rollup"):
+            if line.startswith("Pss:"):
+                pss_kb = int(line.split()[1])
+    return rss_kb / 1024, pss_kb / 1024 if pss_kb else None
+'''
+
+LAZY = MEASURE + '''
+started = time.monotonic()
+import app
+elapsed = time.monotonic() - started
+rss, pss = memory()
+print(json.dumps({"boot_s": elapsed, "rss_mb": rss, "pss_mb": pss}))
+'''
+
+EAGER = MEASURE + '''
+started = time.monotonic()
+import app
+from serving import get_detection_service
+get_detection_service()
+elapsed = time.monotonic() - started
+rss, pss = memory()
+print(json.dumps({"boot_s": elapsed, "rss_mb": rss, "pss_mb": pss}))
+'''
+
+FORKED = MEASURE + '''
+import app
+from inference_backend import load_tflite
+load_tflite()
+
+workers = int(sys.argv[1])
+pipes = []
+for _ in range(workers):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        started = time.monotonic()
+        from serving import get_detection_service
+        get_detection_service()
+        elapsed = time.monotonic() - started
+        # Wait until every sibling has loaded so shared pages are split between them
+        time.sleep(workers * 2)
+        rss, pss = memory()
+        os.write(write_fd, json.dumps({"boot_s": elapsed, "rss_mb": rss, "pss_mb": pss}).encode())
+        os._exit(0)
+    os.close(write_fd)
+    pipes.append((pid, read_fd))
+
+results = []
+for pid, read_fd in pipes:
+    with os.fdopen(read_fd) as f:
+        results.append(json.loads(f.read()))
+    os.waitpid(pid, 0)
+
+print(json.dumps({
+    "boot_s": sum(r["boot_s"] for r in results) / len(results),
+    "rss_mb": sum(r["rss_mb"] for r in results) / len(results),
+    "pss_mb": sum(r["pss_mb"] or 0 for r in results) / len(results)
+}))
+'''
+
+
+def run(script, *args):
+    """Run a measurement script in a fresh interpreter and return its JSON result"""
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL="3")
+    output = subprocess.run(
+        [sys.executable, "-c", script, *args],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2, help="workers to fork in forked mode")
+    args = parser.parse_args()
+
+    print(f"{'mode':>8} {'boot s':>8} {'RSS MB':>8} {'PSS MB':>8}")
+    for mode, script, script_args in [
+        ("lazy", LAZY, []),
+        ("eager", EAGER, []),
+        ("forked", FORKED, [str(args.workers)])
+    ]:
+        result = run(script, *script_args)
+        pss = f"{result['pss_mb']:.1f}" if result["pss_mb"] else "n/a"
+        print(f"{mode:>8} {result['boot_s']:>8.2f} {result['rss_mb']:>8.1f} {pss:>8}")
+
+
+if __name__ == "__main__":
+    main()
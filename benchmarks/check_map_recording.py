@@ -0,0 +1,193 @@
+"""
+Check that detections with coordinates end up in the database.
+
+Runs against a scratch database and boundary file in a temporary folder:
+- a GPS fix inside a boundary polygon whose name is not in the districts
+  table falls back to the nearest district centroid and is recorded
+- a GPS fix inside a known polygon is placed in that district
+- a process forked after the database was opened, as a preloaded gunicorn
+  worker is, opens its own connection and its detections are committed
+- the same with FAW_RECORD_ASYNC=1, where the background recorder was
+  built before the fork
+- the background recorder retries flushes that fail, e.g. while the
+  database is locked, and loses no rows when closed during a burst
+
+Prints each check and exits non-zero when one fails.
+
+    python benchmarks/check_map_recording.py
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from map.detector_adapter import DetectorAdapter
+from map.detection_recorder import DetectionRecorder
+
+DETECTION = {"result": "Fall Armyworm larval damage detected", "confidence": 90.0}
+
+
+def square(name, latitude, longitude, half_size=0.05):
+    """GeoJSON feature of a small square district around a point"""
+    ring = [
+        [longitude - half_size, latitude - half_size], [longitude + half_size, latitude - half_size],
+        [longitude + half_size, latitude + half_size], [longitude - half_size, latitude + half_size],
+        [longitude - half_size, latitude - half_size]
+    ]
+    return {"type": "Feature", "properties": {"name": name}, "geometry": {"type": "Polygon", "coordinates": [ring]}}
+
+
+def detection_count(adapter, district):
+    """Detections recorded for a district"""
+    return adapter.db.connection().execute(
+        "SELECT COUNT(*) FROM detections JOIN districts ON districts.id = district_id WHERE districts.name = ?", (district,)
+    ).fetchone()[0]
+
+
+def check_unknown_polygon(adapter):
+    """A polygon named differently from the districts table falls back to the nearest centroid"""
+    district = adapter.find_district(0.3476, 32.5825)
+    adapter.record_detection(DETECTION, district)
+    return district == "Kampala" and detection_count(adapter, "Kampala") == 1, f"placed in {district}"
+
+
+def check_known_polygon(adapter):
+    """A polygon named like a district is used even where another centroid is nearer"""
+    district = adapter.find_district(2.70, 32.30)
+    return district == "Wakiso", f"placed in {district}"
+
+
+def forked(child):
+    """Run child() in a forked process; True when it returned True"""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            ok = child()
+        except Exception as e:
+            print(f"  forked child failed: {e}")
+            ok = False
+        os._exit(0 if ok else 1)
+    return os.waitpid(pid, 0)[1] == 0
+
+
+def check_fork_connection(adapter):
+    """A forked worker opens its own connection and its detections are committed"""
+    parent_connection = adapter.db.connection()
+    before = detection_count(adapter, "Jinja")
+
+    def child():
+        if adapter.db.connection() is parent_connection:
+            print("  forked child reused the parent's connection")
+            return False
+        adapter.record_detection(DETECTION, "Jinja")
+        adapter.close()
+        return True
+
+    ok = forked(child)
+    recorded = detection_count(adapter, "Jinja") - before
+    return ok and recorded == 1, f"{recorded} of 1 rows committed"
+
+
+def check_fork_recorder(adapter):
+    """A forked worker records through its own background writer"""
+    os.environ["FAW_RECORD_ASYNC"] = "1"
+    recording = DetectorAdapter()
+    before = detection_count(adapter, "Mbarara")
+
+    def child():
+        for _ in range(5):
+            recording.record_detection(DETECTION, "Mbarara")
+        recording.close()
+        stats = recording.recorder.get_stats()
+        if stats["rows_written"] != 5:
+            print(f"  forked child wrote {stats['rows_written']} of {stats['rows_queued']} queued rows")
+            return False
+        return True
+
+    ok = forked(child)
+    recording.close()
+    recorded = detection_count(adapter, "Mbarara") - before
+    return ok and recorded == 5, f"{recorded} of 5 rows committed"
+
+
+class LockedDatabase:
+    """A DetectionDatabase whose first few multi-row writes fail as if another process held the lock"""
+    def __init__(self, db, failures):
+        self.db = db
+        self.failures = failures
+
+    def get_district_id(self, district_name):
+        return self.db.get_district_id(district_name)
+
+    def add_detection_rows(self, rows):
+        if self.failures and len(rows) > 1:
+            self.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        self.db.add_detection_rows(rows)
+
+
+def check_recorder_retries(adapter):
+    """Flushes that fail are retried and no row is lost"""
+    recorder = DetectionRecorder(LockedDatabase(adapter.db, failures=5), flush_interval_ms=50, retries=3, retry_delay=0.01)
+    before = detection_count(adapter, "Gulu")
+    for _ in range(20):
+        recorder.add_detection("Gulu", "healthy-maize", 0.9)
+    recorder.close()
+    recorded = detection_count(adapter, "Gulu") - before
+    stats = recorder.get_stats()
+    return recorded == 20 and stats["rows_failed"] == 0, f"{recorded} of 20 rows committed, {stats['flush_retries']} retries"
+
+
+def check_recorder_close_race(adapter):
+    """Rows added while the recorder closes are all written"""
+    recorder = DetectionRecorder(adapter.db, max_queue_size=64, flush_interval_ms=5)
+    before = detection_count(adapter, "Wakiso")
+    threads = [
+        threading.Thread(target=lambda: [recorder.add_detection("Wakiso", "healthy-maize", 0.9) for _ in range(200)])
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    recorder.close()
+    for thread in threads:
+        thread.join()
+    recorded = detection_count(adapter, "Wakiso") - before
+    return recorded == 1600, f"{recorded} of 1600 rows committed"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as scratch:
+        boundaries = os.path.join(scratch, "districts.geojson")
+        with open(boundaries, "w") as f:
+            json.dump({"type": "FeatureCollection", "features": [
+                square("Kampala City", 0.3476, 32.5825),
+                # Deliberately around Gulu's centroid
+                square("Wakiso", 2.70, 32.30)
+            ]}, f)
+        os.environ["FAW_DISTRICT_BOUNDARIES"] = boundaries
+        # DetectorAdapter opens detections.db in the working directory
+        os.chdir(scratch)
+
+        adapter = DetectorAdapter()
+        for check in (check_unknown_polygon, check_known_polygon, check_fork_connection, check_fork_recorder,
+                      check_recorder_retries, check_recorder_close_race):
+            ok, detail = check(adapter)
+            failures += not ok
+            print(f"{'ok' if ok else 'FAILED'}  {check.__doc__} ({detail})")
+        adapter.close()
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
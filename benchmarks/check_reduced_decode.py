@@ -0,0 +1,110 @@
+"""
+Check that decoding large JPEGs at reduced resolution leaves predictions unchanged.
+
+Each photo in uploads/ (or the paths given) is also re-encoded at phone
+camera sizes. Every variant is run through the detector twice: decoded in
+full as before, and decoded with the IMREAD_REDUCED_COLOR_* flag the
+preprocessor now picks. The script prints the reduction used, the decode
+time of both paths, how far apart the model inputs are and whether the
+result changed. It exits non-zero on any mismatch.
+
+    python benchmarks/check_reduced_decode.py
+    python benchmarks/check_reduced_decode.py --sizes 4000x3000,1600x1200 photos/*.jpg
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # Model and class map paths are relative to the repo root
+
+from model_utils import get_detector
+from image_utils import load_image, decode_flag, jpeg_dimensions
+
+FLAG_NAMES = {
+    cv2.IMREAD_COLOR: "full",
+    cv2.IMREAD_REDUCED_COLOR_2: "1/2",
+    cv2.IMREAD_REDUCED_COLOR_4: "1/4",
+    cv2.IMREAD_REDUCED_COLOR_8: "1/8",
+}
+
+
+def variants(paths, sizes, quality):
+    """Yield (label, encoded bytes): each file as is, then re-encoded at each size"""
+    for path in paths:
+        with open(path, "rb") as f:
+            data = f.read()
+        yield os.path.basename(path), data
+
+        image = cv2.imread(path)
+        for width, height in sizes:
+            resized = cv2.resize(image, (width, height), interpolation=cv2.INTER_CUBIC)
+            encoded = cv2.imencode(".jpg", resized, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+            yield f"{os.path.basename(path)}@{width}x{height}", encoded
+
+
+def best_time(func, repeat):
+    """Best-of-repeat wall time of a call, in milliseconds"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", nargs="*", help="JPEG files (default: uploads/*)")
+    parser.add_argument("--sizes", default="4032x3024,3024x4032,1920x1080", help="re-encode each image at these sizes")
+    parser.add_argument("--quality", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    paths = args.images or sorted(glob.glob(os.path.join("uploads", "*")))
+    sizes = [tuple(int(n) for n in size.split("x")) for size in args.sizes.split(",") if size]
+
+    detector = get_detector()
+    preprocessor = detector.preprocessor
+    decode_size = preprocessor.decode_size
+
+    mismatches = 0
+    print(f"{'image':<48} {'pixels':>10} {'decode':>6} {'full ms':>8} {'reduced ms':>11} {'input diff':>11} {'conf diff':>10}  result")
+    for label, data in variants(paths, sizes, args.quality):
+        full = load_image(data)
+        reduced = load_image(data, decode_size)
+
+        full_ms = best_time(lambda: load_image(data), args.repeat)
+        reduced_ms = best_time(lambda: load_image(data, decode_size), args.repeat)
+
+        # Mean per-pixel difference of the normalised detector input (0-1 scale)
+        full_input = preprocessor.model_input(cv2.cvtColor(full, cv2.COLOR_BGR2RGB), "detector")
+        reduced_input = preprocessor.model_input(cv2.cvtColor(reduced, cv2.COLOR_BGR2RGB), "detector")
+        input_diff = float(np.abs(full_input - reduced_input).mean())
+
+        full_result = detector.detect(full)
+        reduced_result = detector.detect(reduced)
+        same = full_result["result"] == reduced_result["result"] and full_result["is_maize"] == reduced_result["is_maize"]
+        conf_diff = abs(full_result["confidence"] - reduced_result["confidence"])
+        mismatches += not same
+
+        dimensions = jpeg_dimensions(data)
+        pixels = f"{dimensions[0]}x{dimensions[1]}" if dimensions else "?"
+        print(
+            f"{label[:48]:<48} {pixels:>10} {FLAG_NAMES[decode_flag(data, decode_size)]:>6} {full_ms:>8.1f} {reduced_ms:>11.1f}"
+            f" {input_diff:>11.4f} {conf_diff:>10.2f}  {'same' if same else 'CHANGED: ' + full_result['result'] + ' -> ' + reduced_result['result']}"
+        )
+
+    print()
+    print("no prediction changed" if not mismatches else f"{mismatches} predictions changed")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
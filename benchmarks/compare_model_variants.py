@@ -0,0 +1,138 @@
+"""
+Compare float16 / int8 model variants against the shipped float models.
+
+Every variant is run over a local image folder and compared with the
+reference (the float models, or --reference) on:
+- size: detector + classifier file size
+- latency: median and p90 of detect() per image
+- agreement: share of images whose final class, as decided by
+  determine_final_class() on the raw detections (or "not-maize" when the
+  classifier rejects the image), matches the reference
+- accuracy: share of images whose final class matches their label, when
+  the folder is labelled with one subfolder per class
+  (fall-armyworm-larval-damage, fall-armyworm-egg, fall-armyworm-frass,
+  healthy-maize, not-maize)
+
+A variant names its detector and, optionally, classifier file:
+
+    python benchmarks/compare_model_variants.py --images photos/ \\
+        --variant fp16=models/detector_fp16.tflite:models/classifier_fp16.tflite \\
+        --variant int8=models/detector_int8.tflite
+
+Deploy the winner with FAW_DETECTOR_MODEL / FAW_CLASSIFIER_MODEL.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # Model and class map paths are relative to the repo root
+
+from model_utils import FallArmywormDetector, MODEL_PATH
+from maize_leaf_detector import CLASSIFIER_MODEL_PATH
+from inference_backend import invoke_in_place
+from batch_detection import IMAGE_EXTENSIONS
+
+
+def load_images(folder):
+    """Return (label, encoded bytes) pairs; the label is the subfolder name, None for top-level files"""
+    images = []
+    for path in sorted(glob.glob(os.path.join(folder, "**", "*"), recursive=True)):
+        if not path.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        parent = os.path.relpath(os.path.dirname(path), folder)
+        with open(path, "rb") as f:
+            images.append((None if parent == "." else parent, f.read()))
+    return images
+
+
+def final_class(detector, image):
+    """The class determine_final_class() picks for an image, or 'not-maize'"""
+    preprocessor = detector.preprocessor
+    rgb = preprocessor.load_rgb(image)
+    maize = detector.maize_classifier.classify_in_place(
+        lambda tensor: preprocessor.model_input(rgb, "classifier", out=tensor)
+    )[0]
+    if not maize["is_maize"]:
+        return "not-maize"
+
+    def read(outputs):
+        detections = detector.process_detections(
+            outputs[detector.boxes_index], outputs[detector.classes_index], outputs[detector.scores_index]
+        )
+        return detector.determine_final_class(detections)["class"]
+
+    return invoke_in_place(
+        detector.interpreter, detector.input_details[0]["index"],
+        lambda tensor: preprocessor.model_input(rgb, "detector", out=tensor),
+        detector.output_indices, read
+    )
+
+
+def parse_variant(value):
+    """NAME=DETECTOR[:CLASSIFIER] -> (name, detector path, classifier path)"""
+    name, _, paths = value.partition("=")
+    if not paths:
+        raise argparse.ArgumentTypeError("variants are given as NAME=DETECTOR[:CLASSIFIER]")
+    detector_path, _, classifier_path = paths.partition(":")
+    return name, detector_path, classifier_path or CLASSIFIER_MODEL_PATH
+
+
+def measure(detector, images, warmup):
+    """Final classes and per-image detect() latencies in milliseconds"""
+    for _, data in images[:warmup]:
+        detector.detect(data)
+
+    classes = [final_class(detector, data) for _, data in images]
+    timings = []
+    for _, data in images:
+        started = time.perf_counter()
+        detector.detect(data)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return classes, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default="uploads", help="image folder, optionally with one subfolder per class")
+    parser.add_argument("--variant", action="append", type=parse_variant, default=[], help="NAME=DETECTOR[:CLASSIFIER]")
+    parser.add_argument("--reference", type=parse_variant, default=("float", MODEL_PATH, CLASSIFIER_MODEL_PATH))
+    parser.add_argument("--warmup", type=int, default=3)
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    if not images:
+        sys.exit(f"No images found in {args.images}")
+    labels = [label for label, _ in images]
+    labelled = any(label is not None for label in labels)
+
+    rows = []
+    reference_classes = None
+    for name, detector_path, classifier_path in [args.reference] + args.variant:
+        detector = FallArmywormDetector(detector_path, classifier_path)
+        classes, timings = measure(detector, images, args.warmup)
+        if reference_classes is None:
+            reference_classes = classes
+
+        size_mb = (os.path.getsize(detector_path) + os.path.getsize(classifier_path)) / (1024 * 1024)
+        agreement = sum(a == b for a, b in zip(classes, reference_classes)) / len(images)
+        scored = [(label, c) for label, c in zip(labels, classes) if label is not None]
+        accuracy = sum(label == c for label, c in scored) / len(scored) if scored else None
+        input_types = "/".join(
+            detail["dtype"].__name__ for detail in (detector.maize_classifier.input_details[0], detector.input_details[0])
+        )
+        rows.append((name, input_types, size_mb, timings[len(timings) // 2], timings[int(len(timings) * 0.9)], agreement, accuracy))
+
+    print(f"{len(images)} images{' (labelled)' if labelled else ''}, reference {args.reference[0]}")
+    print(f"{'variant':>10} {'inputs':>16} {'size MB':>8} {'p50 ms':>7} {'p90 ms':>7} {'agreement':>10} {'accuracy':>9}")
+    for name, input_types, size_mb, p50, p90, agreement, accuracy in rows:
+        accuracy = f"{accuracy:.1%}" if accuracy is not None else "n/a"
+        print(f"{name:>10} {input_types:>16} {size_mb:>8.2f} {p50:>7.1f} {p90:>7.1f} {agreement:>10.1%} {accuracy:>9}")
+
+
+if __name__ == "__main__":
+    main()
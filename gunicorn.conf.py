@@ -0,0 +1,32 @@
+# Gunicorn configuration: gunicorn -c gunicorn.conf.py app:app
+#
+# The app is imported once in the master before forking. That is cheap
+# because the models load lazily, and TensorFlow itself is imported here so
+# every worker shares its code and module memory copy-on-write. Interpreters
+# are not fork-safe, so each worker loads and warms up its own right after
+# forking; the weights are mmapped from the .tflite files and shared through
+# the page cache. /api/ready reports 503 until the worker is warmed up.
+# With FAW_INFERENCE_SIDECAR set, workers instead connect to the inference
+# sidecar and hold no models at all.
+import os
+from inference_backend import load_inference_config
+
+preload_app = True
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# Worker count found by tune_inference.py, unless WEB_CONCURRENCY or -w says otherwise
+if 'WEB_CONCURRENCY' not in os.environ and isinstance(load_inference_config().get('workers'), int):
+    workers = load_inference_config()['workers']
+
+
+def when_ready(server):
+    if os.environ.get('FAW_INFERENCE_SIDECAR'):
+        # The models live in inference_sidecar.py; workers never import TensorFlow
+        return
+    from inference_backend import load_tflite
+    load_tflite()
+
+
+def post_fork(server, worker):
+    from serving import start_loading
+    start_loading()
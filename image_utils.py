@@ -0,0 +1,184 @@
+import struct
+import numpy as np
+import cv2
+from inference_backend import quantize
+
+# libjpeg can scale the DCT while decoding, producing 1/2, 1/4 or 1/8 of the pixels directly
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+# JPEG start-of-frame markers; C4, C8 and CC share the range but are not frames
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+class RGBImage:
+    """
+    Raw uint8 RGB pixels, e.g. a photo the client already resized to the
+    model input size, used as they are without any decoding.
+    """
+    def __init__(self, data, width, height):
+        width, height = int(width), int(height)
+        if width <= 0 or height <= 0:
+            raise ValueError("Image width and height must be positive")
+        if len(data) != width * height * 3:
+            raise ValueError(f"Expected {width * height * 3} bytes of RGB data for {width}x{height}, got {len(data)}")
+        # A view of the request buffer, not a copy
+        self.pixels = np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3)
+
+    def __len__(self):
+        """Size in bytes, like the encoded uploads it stands in for"""
+        return self.pixels.nbytes
+
+
+def jpeg_dimensions(data):
+    """Return (width, height) from a JPEG's start-of-frame header, or None if it cannot be found"""
+    view = memoryview(data)
+    if len(view) < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        return None
+
+    offset = 2
+    while offset + 4 <= len(view):
+        if view[offset] != 0xFF:
+            return None
+        marker = view[offset + 1]
+        if marker == 0xFF:
+            # Fill byte before the marker
+            offset += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            # Standalone markers carry no length
+            offset += 2
+            continue
+        length = struct.unpack_from(">H", view, offset + 2)[0]
+        if marker in JPEG_SOF_MARKERS:
+            if offset + 9 > len(view):
+                return None
+            height, width = struct.unpack_from(">HH", view, offset + 5)
+            return width, height
+        offset += 2 + length
+    return None
+
+
+def decode_flag(data, min_size):
+    """
+    Pick the imdecode flag for an encoded image that only needs to be
+    min_size pixels on its shorter side: the largest JPEG reduction that
+    still covers it, or IMREAD_COLOR.
+
+    Only JPEG decodes faster when reduced; OpenCV decodes other formats in
+    full and resizes, so they keep IMREAD_COLOR.
+    """
+    dimensions = jpeg_dimensions(data) if min_size else None
+    if dimensions is None:
+        return cv2.IMREAD_COLOR
+
+    # EXIF orientation may swap width and height, so compare the shorter side
+    shorter = min(dimensions)
+    for factor, flag in REDUCED_DECODE_FLAGS:
+        # libjpeg rounds the scaled size up
+        if -(-shorter // factor) >= min_size:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def load_image(image, min_size=None):
+    """
+    Return a BGR image as an ndarray.
+
+    Accepts a file path, the raw bytes of an encoded image (e.g. a request
+    body), an RGBImage or an already decoded ndarray, which is returned
+    unchanged. With min_size, large JPEGs are decoded at a reduced
+    resolution that is still at least min_size pixels on each side.
+    """
+    if isinstance(image, np.ndarray):
+        return image
+
+    if isinstance(image, RGBImage):
+        return cv2.cvtColor(image.pixels, cv2.COLOR_RGB2BGR)
+
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        # Decode straight from the request buffer without touching the disk
+        decoded = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), decode_flag(image, min_size))
+        if decoded is None:
+            raise ValueError("Could not decode image data")
+        return decoded
+
+    decoded = cv2.imread(image)
+    if decoded is None:
+        raise ValueError(f"Could not read image at {image}")
+    return decoded
+
+
+class SharedPreprocessor:
+    """
+    Decodes and colour-converts an image once, then produces the normalised
+    input for each model from that single RGB buffer.
+
+    Images are resized into buffers allocated once and reused for every
+    request, then normalised into the array the caller passes (usually an
+    interpreter's input tensor), so a preprocessor must only be used by one
+    thread at a time.
+    """
+    def __init__(self, input_sizes, input_details=None):
+        # input_sizes maps a model name to its (height, width); input_details
+        # optionally to its interpreter input detail, for models that are not float32
+        self.input_sizes = {name: (int(height), int(width)) for name, (height, width) in input_sizes.items()}
+        input_details = input_details or {}
+        self.dtypes = {}
+        self.luts = {}
+        for name in self.input_sizes:
+            detail = input_details.get(name)
+            self.dtypes[name] = np.dtype(detail['dtype']) if detail else np.dtype(np.float32)
+            if self.dtypes[name].kind != 'f':
+                # Quantized inputs: one table lookup per pixel value replaces the float maths
+                lut = quantize(np.arange(256, dtype=np.float32) / 255.0, detail)
+                identity = lut.dtype == np.uint8 and (lut == np.arange(256)).all()
+                self.luts[name] = None if identity else lut
+        # Encoded images only need decoding to the largest model input
+        self.decode_size = max(max(size) for size in self.input_sizes.values())
+        self.resized = {
+            name: np.empty((height, width, 3), dtype=np.uint8)
+            for name, (height, width) in self.input_sizes.items()
+        }
+
+    def load_rgb(self, image):
+        """Decode an image (path, encoded bytes, RGBImage or BGR ndarray) and convert it to RGB"""
+        if isinstance(image, RGBImage):
+            # Already RGB, nothing to decode or convert
+            return image.pixels
+
+        decoded = load_image(image, self.decode_size)
+        if decoded is image:
+            # The caller's array, leave it untouched
+            return cv2.cvtColor(decoded, cv2.COLOR_BGR2RGB)
+        # Freshly decoded, so swap the channels in place rather than allocating a copy
+        return cv2.cvtColor(decoded, cv2.COLOR_BGR2RGB, dst=decoded)
+
+    def model_input(self, rgb, name, out=None):
+        """Resize and normalise an RGB image into out, or a new (1, height, width, 3) array of the model's dtype"""
+        height, width = self.input_sizes[name]
+        if out is None:
+            out = np.empty((1, height, width, 3), dtype=self.dtypes[name])
+
+        resized = self.resized[name]
+        cv2.resize(rgb, (width, height), dst=resized)
+
+        if self.dtypes[name].kind == 'f':
+            # Normalise pixel values straight into the output array
+            np.divide(resized, 255.0, out=out[0], dtype=np.float32)
+        elif self.luts[name] is None:
+            # A uint8 model that takes the pixels as they are
+            np.copyto(out[0], resized)
+        else:
+            np.take(self.luts[name], resized, out=out[0], mode='clip')
+
+        return out
+
+    def model_inputs(self, rgbs, name, out):
+        """Fill a padded (batch_size, height, width, 3) input, e.g. an interpreter's input tensor, from several RGB images"""
+        for row, rgb in enumerate(rgbs):
+            self.model_input(rgb, name, out=out[row:row + 1])
+
+        # Blank out padding rows left over from an earlier, fuller batch
+        out[len(rgbs):] = 0
+
+        return out
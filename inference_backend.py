@@ -0,0 +1,194 @@
+import importlib
+import json
+import os
+import threading
+import numpy as np
+
+# Packages that provide a TFLite Interpreter, all with the same API
+# (get_input_details, resize_tensor_input, allocate_tensors, set_tensor,
+# tensor, invoke, get_tensor), so the detectors work with any of them.
+# The standalone runtimes are a few MB against TensorFlow's several hundred.
+BACKENDS = {
+    "tensorflow": "tensorflow.lite",
+    "tflite_runtime": "tflite_runtime.interpreter",
+    "litert": "ai_edge_litert.interpreter",
+}
+
+# "auto" takes the lightest runtime that is installed
+AUTO_ORDER = ("litert", "tflite_runtime", "tensorflow")
+
+_backend = None
+_backend_name = None
+_backend_lock = threading.Lock()
+
+# Tuned settings from tune_inference.py, read once per process
+_inference_config = None
+
+
+def import_backend(name):
+    """Import one backend's module, raising ImportError when it is not installed"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {name!r}, expected auto or one of {', '.join(BACKENDS)}")
+    path = BACKENDS[name]
+    importlib.import_module(path)
+
+    # Resolve it as "import a.b as c" would; tensorflow.lite is an attribute
+    # alias, not the module of the same name in sys.modules
+    module = importlib.import_module(path.split(".")[0])
+    for part in path.split(".")[1:]:
+        module = getattr(module, part)
+    return module
+
+
+def load_tflite():
+    """
+    Import the inference runtime chosen by FAW_INFERENCE_BACKEND on first use
+    and return the module holding its Interpreter class; importing TensorFlow
+    dominates startup time
+    """
+    global _backend, _backend_name
+    with _backend_lock:
+        if _backend is None:
+            name = os.environ.get("FAW_INFERENCE_BACKEND", "auto")
+            if name != "auto":
+                _backend, _backend_name = import_backend(name), name
+            else:
+                for candidate in AUTO_ORDER:
+                    try:
+                        _backend, _backend_name = import_backend(candidate), candidate
+                        break
+                    except ImportError:
+                        continue
+                else:
+                    raise ImportError("No TFLite runtime found, install tflite-runtime, ai-edge-litert or tensorflow")
+            print(f"Inference backend: {_backend_name}")
+    return _backend
+
+
+def backend_name():
+    """Name of the loaded inference backend, None before the first model is loaded"""
+    return _backend_name
+
+
+def load_inference_config():
+    """
+    Return the settings written by tune_inference.py to FAW_INFERENCE_CONFIG
+    (default inference_config.json), reading the file on first use; {} when
+    the host has not been tuned or the file cannot be used
+    """
+    global _inference_config
+    with _backend_lock:
+        if _inference_config is None:
+            path = os.environ.get("FAW_INFERENCE_CONFIG", "inference_config.json")
+            _inference_config = {}
+            if os.path.exists(path):
+                try:
+                    with open(path) as f:
+                        config = json.load(f)
+                    if not isinstance(config, dict) or not isinstance(config.get("models", {}), dict):
+                        raise ValueError("expected an object with a models object")
+                    _inference_config = config
+                except (OSError, ValueError) as e:
+                    # A broken file must not stop the models from loading
+                    print(f"Warning: ignoring inference config {path}, the runtime defaults apply: {e}")
+    return _inference_config
+
+
+def interpreter_options(model):
+    """create_interpreter() keyword arguments for the 'classifier' or 'detector' model from the tuned config"""
+    options = load_inference_config().get("models", {}).get(model)
+    if not isinstance(options, dict):
+        options = {}
+    return {"num_threads": options.get("num_threads"), "xnnpack": options.get("xnnpack", True)}
+
+
+def create_interpreter(model_path, input_shape=None, num_threads=None, xnnpack=True):
+    """
+    Create and allocate an interpreter for a .tflite file.
+
+    Models are always loaded from model_path rather than model_content:
+    TFLite then mmaps the file read-only, so every worker process shares the
+    same page-cache pages for the weights instead of holding its own copy.
+    num_threads and xnnpack default to the runtime's own choices.
+    """
+    tflite = load_tflite()
+    options = {}
+    if num_threads:
+        options["num_threads"] = num_threads
+    if not xnnpack:
+        # XNNPACK is applied as the default delegate; this resolver leaves the builtin kernels
+        resolver = getattr(getattr(tflite, "experimental", tflite), "OpResolverType")
+        options["experimental_op_resolver_type"] = resolver.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+    interpreter = tflite.Interpreter(model_path=model_path, **options)
+
+    # Size the input before the first allocate_tensors(); resizing an
+    # interpreter that XNNPACK has already prepared corrupts memory
+    if input_shape is not None:
+        interpreter.resize_tensor_input(interpreter.get_input_details()[0]['index'], input_shape)
+
+    interpreter.allocate_tensors()
+    return interpreter
+
+
+class ModelInterpreters:
+    """
+    The interpreters of one .tflite model: one for single images, created
+    on load, and one per batch size, created on first use. Each is sized
+    before it is allocated, and all run with the threads and XNNPACK setting
+    tuned for the model by tune_inference.py.
+    """
+    def __init__(self, model_path, name):
+        self.model_path = model_path
+        self.options = interpreter_options(name)
+        self.interpreter = create_interpreter(model_path, **self.options)
+        self.input_shape = list(self.interpreter.get_input_details()[0]['shape'][1:])
+        self.by_batch_size = {1: self.interpreter}
+
+    def for_batch(self, batch_size):
+        """Return an interpreter whose input holds batch_size images"""
+        if batch_size not in self.by_batch_size:
+            self.by_batch_size[batch_size] = create_interpreter(self.model_path, [batch_size] + self.input_shape, **self.options)
+        return self.by_batch_size[batch_size]
+
+
+def quantize(values, detail):
+    """
+    Convert model input values (pixels scaled to 0-1, as the float models
+    expect) to an input tensor's dtype, applying its quantization
+    """
+    dtype = np.dtype(detail['dtype'])
+    if dtype.kind == 'f':
+        return values.astype(dtype, copy=False)
+
+    scale, zero_point = detail['quantization']
+    if scale:
+        values = np.round(values / scale + zero_point)
+    else:
+        # Integer input without quantization parameters takes raw pixel values
+        values = np.round(values * 255.0)
+    info = np.iinfo(dtype)
+    return np.clip(values, info.min, info.max).astype(dtype)
+
+
+def dequantize(values, detail):
+    """Return an output tensor's values as real numbers; float outputs are returned unchanged"""
+    scale, zero_point = detail['quantization']
+    if np.dtype(detail['dtype']).kind == 'f' or not scale:
+        return values
+    return (values.astype(np.float32) - zero_point) * scale
+
+
+def invoke_in_place(interpreter, input_index, fill, output_indices, read):
+    """
+    Run an interpreter without copying its input or outputs.
+
+    fill(array) writes the input straight into the interpreter's input
+    tensor and read(arrays) turns views of the output tensors into a
+    result. TFLite refuses to invoke while a view of its buffers is alive,
+    so neither callback may keep the arrays it is given, and read() must
+    return new objects rather than views.
+    """
+    # tensor() must be called afresh each time; holding the accessor pins the buffers too
+    fill(interpreter.tensor(input_index)())
+    interpreter.invoke()
+    return read([interpreter.tensor(index)() for index in output_indices])
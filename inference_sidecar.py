@@ -0,0 +1,393 @@
+"""
+Inference sidecar: one process that holds the models for every web worker.
+
+    python inference_sidecar.py --socket /tmp/faw-inference.sock
+    FAW_INFERENCE_SIDECAR=/tmp/faw-inference.sock gunicorn -c gunicorn.conf.py app:app
+
+The sidecar builds the usual detection service (pool, batching and result
+cache as configured by the FAW_* variables) and listens on a unix socket.
+Each client connection is given a slot in one shared memory segment; the
+web worker writes the upload (or decoded pixels) into its slot and sends
+only a small descriptor over the socket, so image bytes are never pickled.
+Web workers running SidecarDetectionService never import TensorFlow.
+"""
+import argparse
+import atexit
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from image_utils import RGBImage
+
+DEFAULT_ADDRESS = "/tmp/faw-inference.sock"
+
+
+class InferenceError(Exception):
+    """Raised in the web worker when the sidecar could not run a detection"""
+    pass
+
+
+def pack_images(images, slot):
+    """
+    Copy images into a shared memory slot and return their descriptors.
+
+    Encoded uploads are copied as is, RGBImages and decoded BGR arrays as
+    pixels. Raises InferenceError when they do not fit.
+    """
+    items = []
+    offset = 0
+    for image in images:
+        if isinstance(image, str):
+            with open(image, "rb") as f:
+                image = f.read()
+
+        if isinstance(image, RGBImage):
+            kind, pixels = "rgb", image.pixels
+        elif isinstance(image, np.ndarray):
+            kind, pixels = "bgr", image
+        else:
+            kind, pixels = "encoded", None
+
+        size = pixels.nbytes if pixels is not None else len(image)
+        if offset + size > len(slot):
+            raise InferenceError(f"Images do not fit the {len(slot)} byte shared memory slot")
+
+        if pixels is not None:
+            target = np.ndarray(pixels.shape, dtype=np.uint8, buffer=slot, offset=offset)
+            np.copyto(target, pixels)
+            del target
+            items.append((kind, offset, size, pixels.shape))
+        else:
+            slot[offset:offset + size] = image
+            items.append((kind, offset, size, None))
+        offset += size
+    return items
+
+
+def unpack_images(items, slot):
+    """Turn descriptors from pack_images() back into images that are views of the slot"""
+    images = []
+    for kind, offset, size, shape in items:
+        data = slot[offset:offset + size]
+        if kind == "rgb":
+            images.append(RGBImage(data, shape[1], shape[0]))
+        elif kind == "bgr":
+            images.append(np.frombuffer(data, dtype=np.uint8).reshape(shape))
+        else:
+            images.append(data)
+    return images
+
+
+def detection_stats(service):
+    """Walk a chain of wrapped services collecting get_stats(), as /api/stats does"""
+    stats = {}
+    while hasattr(service, 'get_stats'):
+        stats[type(service).__name__] = service.get_stats()
+        service = getattr(service, 'detector', None)
+    return stats
+
+
+class InferenceSidecar:
+    """
+    Serves detect() and detect_batch() for web workers over a unix socket,
+    with the images passed through shared memory slots.
+
+    Each connection is handled by its own thread and keeps one slot for as
+    long as it is open, so a web worker holds at most one request in flight
+    per connection. The detection service behind it decides how many run at
+    once (FAW_POOL_SIZE) and whether requests from different workers are
+    batched together (FAW_BATCH_MAX_SIZE).
+    """
+    def __init__(self, service, detector, address=DEFAULT_ADDRESS, slots=32, slot_bytes=16 * 1024 * 1024, authkey=None):
+        self.service = service
+        self.detector = detector
+        self.address = address
+        self.slot_bytes = slot_bytes
+        self.authkey = authkey
+
+        # tmpfs only backs the pages that are written, so unused slots cost nothing
+        self.memory = SharedMemory(name=f"faw-inference-{os.getpid()}", create=True, size=slots * slot_bytes)
+        self.free_slots = queue.Queue()
+        for slot in range(slots):
+            self.free_slots.put(slot)
+
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        self.listener = None
+
+    def serve_forever(self):
+        """Accept connections until the process is stopped"""
+        if os.path.exists(self.address):
+            # Left behind by a sidecar that did not shut down cleanly
+            os.unlink(self.address)
+        self.listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        print(f"Inference sidecar listening on {self.address} with {self.free_slots.qsize()} slots of {self.slot_bytes} bytes")
+
+        while True:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                break
+            except Exception as e:
+                # e.g. a client with the wrong authkey
+                print(f"Inference sidecar rejected a connection: {e}")
+                continue
+            threading.Thread(target=self.handle, args=(conn,), name="sidecar-connection", daemon=True).start()
+
+    def handle(self, conn):
+        """Serve one client connection until it closes"""
+        try:
+            slot = self.free_slots.get_nowait()
+        except queue.Empty:
+            conn.send(("error", "No free shared memory slots, start the sidecar with more --slots"))
+            conn.close()
+            return
+
+        offset = slot * self.slot_bytes
+        with self.lock:
+            self.connections += 1
+        try:
+            conn.send(("ok", {"memory": self.memory.name, "offset": offset, "size": self.slot_bytes}))
+            view = self.memory.buf[offset:offset + self.slot_bytes]
+            try:
+                while True:
+                    try:
+                        op, items = conn.recv()
+                    except EOFError:
+                        break
+                    conn.send(self.run(op, items, view))
+            finally:
+                view.release()
+        except OSError:
+            # The web worker went away mid-request
+            pass
+        finally:
+            conn.close()
+            self.free_slots.put(slot)
+            with self.lock:
+                self.connections -= 1
+
+    def run(self, op, items, view):
+        """Run one request and return the ('ok', result) or ('error', message) reply"""
+        with self.lock:
+            self.requests += 1
+        try:
+            if op == "detect":
+                return "ok", self.service.detect(unpack_images(items, view)[0])
+            if op == "detect_batch":
+                return "ok", self.service.detect_batch(unpack_images(items, view))
+            if op == "info":
+                return "ok", {"model_version": self.detector.model_version, "input_shapes": self.detector.get_input_shapes()}
+            if op == "stats":
+                stats = detection_stats(self.service)
+                stats[type(self).__name__] = self.get_stats()
+                return "ok", stats
+            return "error", f"Unknown request {op!r}"
+        except ValueError as e:
+            # A bad upload, e.g. bytes that are not an image; the worker raises it as a ValueError
+            return "invalid", str(e)
+        except Exception as e:
+            with self.lock:
+                self.errors += 1
+            return "error", str(e)
+
+    def get_stats(self):
+        """Return connection and request counters"""
+        with self.lock:
+            return {
+                "connections": self.connections,
+                "free_slots": self.free_slots.qsize(),
+                "requests": self.requests,
+                "errors": self.errors
+            }
+
+    def close(self):
+        """Stop listening and remove the socket and shared memory"""
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        self.memory.unlink()
+        try:
+            self.memory.close()
+        except BufferError:
+            # Connection threads still hold views of their slots; the mapping goes with the process
+            pass
+
+
+class SidecarConnection:
+    """One client connection to the sidecar with the shared memory slot it was given"""
+    def __init__(self, address, authkey):
+        self.conn = Client(address, family="AF_UNIX", authkey=authkey)
+        status, details = self.conn.recv()
+        if status != "ok":
+            self.conn.close()
+            raise InferenceError(details)
+
+        try:
+            self.memory = SharedMemory(name=details["memory"])
+        except OSError:
+            self.conn.close()
+            raise
+        # The sidecar owns the segment; without this the resource tracker
+        # would remove it when this worker exits
+        resource_tracker.unregister(self.memory._name, "shared_memory")
+        self.slot = self.memory.buf[details["offset"]:details["offset"] + details["size"]]
+
+    def request(self, op, images=()):
+        """Send one request and wait for its reply"""
+        self.conn.send((op, pack_images(images, self.slot)))
+        return self.conn.recv()
+
+    def close(self):
+        """Release the slot, detach from the shared memory and close the socket"""
+        self.slot.release()
+        self.memory.close()
+        self.conn.close()
+
+
+class SidecarDetectionService:
+    """
+    Detection service for web workers that forwards every detection to an
+    InferenceSidecar, so the worker itself never loads the models.
+
+    Has the detect()/detect_batch() interface of the local service, plus
+    model_version and get_input_shapes() from the sidecar's detector.
+    Connections are pooled; each carries one request at a time.
+    """
+    def __init__(self, address=DEFAULT_ADDRESS, authkey=None, max_connections=4, connect_timeout=30):
+        self.address = address
+        self.authkey = authkey
+        self.idle = queue.LifoQueue()
+        self.available = threading.BoundedSemaphore(max_connections)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.reconnects = 0
+
+        # The sidecar may still be loading its models, so wait for it to come up
+        deadline = time.monotonic() + connect_timeout
+        while True:
+            try:
+                info = self.call("info")
+                break
+            except InferenceError:
+                if time.monotonic() > deadline:
+                    raise InferenceError(f"Inference sidecar at {address} is not answering")
+                time.sleep(0.5)
+        self.model_version = info["model_version"]
+        self.input_shapes = info["input_shapes"]
+        atexit.register(self.close)
+
+    def get_input_shapes(self):
+        """Each model's input as [height, width, channels], as reported by the sidecar"""
+        return self.input_shapes
+
+    def connect(self):
+        """Open a new connection to the sidecar"""
+        try:
+            return SidecarConnection(self.address, self.authkey)
+        except (OSError, EOFError) as e:
+            raise InferenceError(f"Inference sidecar at {self.address} is not answering: {e}")
+
+    def call(self, op, images=()):
+        """Run one request on a pooled connection, reconnecting once if the sidecar restarted"""
+        with self.available:
+            try:
+                connection = self.idle.get_nowait()
+                reused = True
+            except queue.Empty:
+                connection = self.connect()
+                reused = False
+
+            try:
+                status, result = connection.request(op, images)
+            except InferenceError:
+                # The images did not fit the slot; the connection itself is fine
+                self.idle.put(connection)
+                raise
+            except (OSError, EOFError):
+                connection.close()
+                if not reused:
+                    raise InferenceError("Lost the connection to the inference sidecar")
+                # A pooled connection to a sidecar that has since restarted
+                with self.lock:
+                    self.reconnects += 1
+                connection = self.connect()
+                try:
+                    status, result = connection.request(op, images)
+                except (OSError, EOFError):
+                    connection.close()
+                    raise InferenceError("Lost the connection to the inference sidecar")
+            self.idle.put(connection)
+
+        with self.lock:
+            self.requests += 1
+        if status == "invalid":
+            raise ValueError(result)
+        if status != "ok":
+            raise InferenceError(result)
+        return result
+
+    def detect(self, image):
+        """Run detection on an image given as a path, encoded bytes, RGBImage or BGR ndarray"""
+        return self.call("detect", [image])
+
+    def detect_batch(self, images):
+        """Run detection on several images in one request"""
+        return self.call("detect_batch", images)
+
+    def get_stats(self):
+        """Return client counters and the sidecar's own statistics"""
+        with self.lock:
+            stats = {"requests": self.requests, "reconnects": self.reconnects, "idle_connections": self.idle.qsize()}
+        try:
+            stats["sidecar"] = self.call("stats")
+        except Exception as e:
+            stats["sidecar"] = {"error": str(e)}
+        return stats
+
+    def close(self):
+        """Close the pooled connections and detach from the shared memory"""
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the detection models in one process shared by all web workers")
+    parser.add_argument("--socket", default=os.environ.get("FAW_INFERENCE_SIDECAR") or DEFAULT_ADDRESS)
+    parser.add_argument("--slots", type=int, default=32, help="shared memory slots, i.e. client connections")
+    parser.add_argument("--slot-mb", type=float, default=16, help="largest request, in MB")
+    args = parser.parse_args()
+
+    from serving import create_detection_service
+    from model_utils import get_detector
+
+    started = time.monotonic()
+    service = create_detection_service(use_sidecar=False)
+    print(f"Detection service ready in {time.monotonic() - started:.2f}s")
+
+    authkey = os.environ.get("FAW_SIDECAR_AUTHKEY")
+    sidecar = InferenceSidecar(
+        service, get_detector(), args.socket, args.slots, int(args.slot_mb * 1024 * 1024),
+        authkey.encode() if authkey else None
+    )
+    atexit.register(sidecar.close)
+    # Run the atexit cleanup on a normal stop too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    sidecar.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
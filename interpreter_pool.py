@@ -0,0 +1,95 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from model_utils import FallArmywormDetector
+
+
+class DetectorPool:
+    """
+    A fixed pool of detectors, each with its own maize classifier and armyworm
+    interpreter, so several threads can run inference at the same time.
+
+    A TFLite interpreter must only be used by one thread at a time. Callers
+    check a detector out, use it and check it back in; detect() and
+    detect_batch() do this for them.
+    """
+    def __init__(self, size=2, detectors=None, detector_factory=FallArmywormDetector):
+        self.size = size
+        self.available = queue.Queue()
+
+        # Reuse any detectors that are already loaded and build the rest
+        detectors = list(detectors or [])[:size]
+        while len(detectors) < size:
+            detectors.append(detector_factory())
+        self.detectors = detectors
+        for detector in detectors:
+            self.available.put(detector)
+
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.waiting = 0
+
+    def checkout(self, timeout=None):
+        """Take a detector from the pool, waiting until one is free"""
+        with self.lock:
+            self.waiting += 1
+
+        started = time.monotonic()
+        try:
+            detector = self.available.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No detector became free within {timeout} seconds")
+        finally:
+            waited = time.monotonic() - started
+            with self.lock:
+                self.waiting -= 1
+
+        with self.lock:
+            self.checkouts += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+        return detector
+
+    def checkin(self, detector):
+        """Return a detector to the pool"""
+        self.available.put(detector)
+
+    @contextmanager
+    def detector(self, timeout=None):
+        """Context manager that checks a detector out and always checks it back in"""
+        detector = self.checkout(timeout)
+        try:
+            yield detector
+        finally:
+            self.checkin(detector)
+
+    def detect(self, image):
+        """Run detection on a pooled detector"""
+        with self.detector() as detector:
+            return detector.detect(image)
+
+    def detect_batch(self, images):
+        """Run batched detection on a pooled detector"""
+        with self.detector() as detector:
+            return detector.detect_batch(images)
+
+    def warmup(self, max_batch_size=1):
+        """Warm up every pooled detector before serving traffic"""
+        for detector in self.detectors:
+            detector.warmup(max_batch_size)
+
+    def get_stats(self):
+        """Return pool size and wait-time metrics"""
+        with self.lock:
+            return {
+                "size": self.size,
+                "available": self.available.qsize(),
+                "waiting": self.waiting,
+                "checkouts": self.checkouts,
+                "average_wait_ms": self.total_wait / self.checkouts * 1000 if self.checkouts else 0.0,
+                "max_wait_ms": self.max_wait * 1000
+            }
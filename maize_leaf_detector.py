@@ -1,12 +1,17 @@
-import tensorflow.lite as tflite
+import os
 import numpy as np
-import cv2
+from inference_backend import ModelInterpreters, invoke_in_place, dequantize
+
+# FAW_CLASSIFIER_MODEL points at another build of the classifier, e.g. a quantized one
+CLASSIFIER_MODEL_PATH = os.environ.get("FAW_CLASSIFIER_MODEL", "maizeleafclassifier2_metadata.tflite")
 
 class MaizeLeafClassifier:
-    def __init__(self, model_path="maizeleafclassifier2_metadata.tflite"):
+    def __init__(self, model_path=None):
+        self.model_path = model_path or CLASSIFIER_MODEL_PATH
+
         # Load the TFLite model
-        self.interpreter = tflite.Interpreter(model_path=model_path)
-        self.interpreter.allocate_tensors()
+        self.interpreters = ModelInterpreters(self.model_path, "classifier")
+        self.interpreter = self.interpreters.interpreter
 
         # Get input and output details
         self.input_details = self.interpreter.get_input_details()
@@ -19,39 +24,26 @@ class MaizeLeafClassifier:
         self.input_shape = self.input_details[0]['shape'][1:3]  # Height, width
         print(f"Maize classifier input shape: {self.input_shape}")
 
-    def preprocess_image(self, image_path):
-        """Preprocess the image for the maize leaf classifier model"""
-        # Read image
-        image = cv2.imread(image_path)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)  # Convert BGR to RGB
-
-        # Resize image to model input size
-        image = cv2.resize(image, (self.input_shape[1], self.input_shape[0]))
-
-        # Normalize pixel values
-        image = image.astype(np.float32) / 255.0
-
-        # Add batch dimension
-        image = np.expand_dims(image, axis=0)
+    def classify_in_place(self, fill, batch_size=1, count=None):
+        """
+        Classify a batch whose preprocessed (batch_size, height, width, 3)
+        input fill(array) writes straight into the interpreter, reading the
+        output without copying; returns the first count results
+        """
+        count = count or batch_size
+        return invoke_in_place(
+            self.interpreters.for_batch(batch_size), self.input_details[0]['index'], fill,
+            [self.output_details[0]['index']],
+            lambda outputs: [self.create_result(outputs[0][i]) for i in range(count)]
+        )
+
+    def create_result(self, output):
+        """Turn one row of classifier output into a result dict"""
+        output = dequantize(output, self.output_details[0])
 
-        return image
-
-    def classify(self, image_path):
-        """Classify if the image contains a maize leaf"""
-        image = self.preprocess_image(image_path)
-
-        # Set input tensor
-        self.interpreter.set_tensor(self.input_details[0]['index'], image)
-
-        # Run inference
-        self.interpreter.invoke()
-
-        # Get output tensor
-        output = self.interpreter.get_tensor(self.output_details[0]['index'])
-        
         # Get predicted class and confidence
-        predicted_class_idx = np.argmax(output[0])
-        confidence = output[0][predicted_class_idx]
+        predicted_class_idx = int(np.argmax(output))
+        confidence = output[predicted_class_idx]
         
         result = {
             "is_maize": predicted_class_idx == 0,  # True if class 0 (Maize)
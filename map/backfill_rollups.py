@@ -0,0 +1,30 @@
+import argparse
+import time
+from database_schema import DetectionDatabase, ROLLUP_BUCKETS
+
+def backfill_rollups(db_path="detections.db"):
+    """
+    Rebuild the hourly, daily and weekly detection rollups from the raw
+    detections, e.g. after importing history with the triggers disabled.
+    """
+    db = DetectionDatabase(db_path)
+
+    started = time.monotonic()
+    db.rebuild_rollups()
+    # latest_detection is derived from the same history, so refresh it too
+    conn = db.connection()
+    with conn:
+        db.rebuild_latest_detections(conn.cursor())
+
+    for bucket, (table, _) in ROLLUP_BUCKETS.items():
+        rows = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        print(f"{table}: {rows} {bucket} buckets")
+    print(f"Rollups rebuilt in {time.monotonic() - started:.1f}s")
+
+    db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the detection rollup tables")
+    parser.add_argument("--db", default="detections.db", help="path to the detections database")
+    args = parser.parse_args()
+    backfill_rollups(args.db)
@@ -1,18 +1,104 @@
 import sqlite3
 import os
+import threading
+import time
+import weakref
+from datetime import datetime, timezone
+
+# Rollup tables of detection counts per district and type, keyed by the SQL
+# expression that maps a timestamp to the start of its bucket
+ROLLUP_BUCKETS = {
+    "hour": ("detections_hourly", "strftime('%Y-%m-%d %H:00:00', {ts})"),
+    "day": ("detections_daily", "datetime({ts}, 'start of day')"),
+    # Weeks start on Monday
+    "week": ("detections_weekly", "datetime({ts}, 'start of day', 'weekday 0', '-6 days')"),
+}
+
+class ThreadConnection:
+    """
+    One thread's connection. Only the thread's local storage refers to it,
+    so the connection is closed when the thread exits.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.pid = os.getpid()
+
+    def __del__(self):
+        # Without this the connection waits for the cyclic garbage collector
+        if self.pid == os.getpid():
+            self.conn.close()
+
 
 class DetectionDatabase:
-    def __init__(self, db_path="detections.db"):
+    def __init__(self, db_path="detections.db", busy_timeout_ms=5000, cache_size_kb=8192, district_refresh_interval=5.0):
         self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kb = cache_size_kb
+        
+        # One long-lived connection per thread, so requests skip connection
+        # setup and reuse the statements sqlite3 has already prepared. The
+        # weak set only finds the ones still open for close()
+        self.local = threading.local()
+        self.connections = weakref.WeakSet()
+        self.connections_lock = threading.Lock()
+        # Connections a forked child copied from its parent. SQLite handles
+        # must not be used across fork(), and closing them in the child could
+        # checkpoint the parent's WAL, so they are only kept from being freed
+        self.inherited_connections = []
+        
+        # District name -> id, so recording a detection is a single INSERT.
+        # Reloaded when the districts version changes, checked at most every
+        # district_refresh_interval seconds
+        self.district_ids = {}
+        self.district_ids_version = None
+        self.district_ids_checked_at = 0.0
+        self.district_refresh_interval = district_refresh_interval
+        self.district_ids_lock = threading.Lock()
+        
         self.initialize_db()
     
+    def open_connection(self):
+        """Open a new connection with the pragmas every connection uses"""
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # WAL lets readers carry on while a detection is written; NORMAL
+        # sync is safe in WAL mode and skips an fsync per commit
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+    
+    def connection(self):
+        """Return this thread's connection, opening and tuning it on first use in this process"""
+        holder = getattr(self.local, 'holder', None)
+        if holder is None or holder.pid != os.getpid():
+            if holder is not None:
+                # A gunicorn worker forked from a master that had already connected
+                self.inherited_connections.append(holder)
+            holder = ThreadConnection(self.open_connection())
+            self.local.holder = holder
+            with self.connections_lock:
+                self.connections.add(holder)
+        return holder.conn
+    
+    def close(self):
+        """Close the connections of this process's live threads, at shutdown"""
+        with self.connections_lock:
+            holders = [holder for holder in self.connections if holder.pid == os.getpid()]
+        for holder in holders:
+            holder.conn.close()
+        self.local = threading.local()
+    
     def initialize_db(self):
         """Create the database and tables if they don't exist"""
         # Check if database file exists
         db_exists = os.path.exists(self.db_path)
         
-        # Connect to database
-        conn = sqlite3.connect(self.db_path)
+        # A connection of its own, closed once the schema is in place, so a
+        # database created in the gunicorn master holds no open handle
+        conn = self.open_connection()
         cursor = conn.cursor()
         
         # Create tables if they don't exist
@@ -36,6 +122,134 @@ class DetectionDatabase:
         )
         ''')
         
+        # Version counter bumped by triggers whenever the districts table
+        # changes, so in-memory district indexes know when to reload
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        ''')
+        cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('districts_version', 0)")
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS districts_version_{event.lower()}
+            AFTER {event} ON districts
+            BEGIN
+                UPDATE meta SET value = value + 1 WHERE key = 'districts_version';
+            END
+            ''')
+        
+        # Same for detections, so cached API responses know when they are stale
+        cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('data_version', 0)")
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS data_version_{event.lower()}
+            AFTER {event} ON detections
+            BEGIN
+                UPDATE meta SET value = value + 1 WHERE key = 'data_version';
+            END
+            ''')
+        
+        # Serves the per-district history and the latest-detection lookups
+        cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_detections_district_timestamp
+        ON detections (district_id, timestamp, id)
+        ''')
+        
+        # The latest detection of every district, kept current by triggers so
+        # the map reads one row per district however long the history gets
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS latest_detection (
+            district_id INTEGER PRIMARY KEY,
+            detection_id INTEGER NOT NULL,
+            detection_type TEXT NOT NULL,
+            confidence REAL NOT NULL,
+            timestamp DATETIME,
+            FOREIGN KEY (district_id) REFERENCES districts (id)
+        )
+        ''')
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'latest_detection_insert'")
+        if cursor.fetchone() is None:
+            # First run against this database: catch up with existing history
+            self.rebuild_latest_detections(cursor)
+        
+        # A newer detection replaces the stored one; ties on timestamp go to the later row
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS latest_detection_insert
+        AFTER INSERT ON detections
+        BEGIN
+            INSERT INTO latest_detection (district_id, detection_id, detection_type, confidence, timestamp)
+            VALUES (NEW.district_id, NEW.id, NEW.detection_type, NEW.confidence, NEW.timestamp)
+            ON CONFLICT (district_id) DO UPDATE SET
+                detection_id = excluded.detection_id,
+                detection_type = excluded.detection_type,
+                confidence = excluded.confidence,
+                timestamp = excluded.timestamp
+            WHERE excluded.timestamp > latest_detection.timestamp
+                OR (excluded.timestamp = latest_detection.timestamp AND excluded.detection_id > latest_detection.detection_id);
+        END
+        ''')
+        
+        # Deleting the latest detection falls back to the one before it
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS latest_detection_delete
+        AFTER DELETE ON detections
+        WHEN OLD.id = (SELECT detection_id FROM latest_detection WHERE district_id = OLD.district_id)
+        BEGIN
+            DELETE FROM latest_detection WHERE district_id = OLD.district_id;
+            INSERT INTO latest_detection (district_id, detection_id, detection_type, confidence, timestamp)
+            SELECT district_id, id, detection_type, confidence, timestamp
+            FROM detections
+            WHERE district_id = OLD.district_id
+            ORDER BY timestamp DESC, id DESC
+            LIMIT 1;
+        END
+        ''')
+        
+        # Counts per time bucket for trend queries, kept current by triggers
+        for bucket, (table, bucket_start) in ROLLUP_BUCKETS.items():
+            cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                bucket_start DATETIME NOT NULL,
+                district_id INTEGER NOT NULL,
+                detection_type TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                confidence_sum REAL NOT NULL,
+                PRIMARY KEY (bucket_start, district_id, detection_type)
+            ) WITHOUT ROWID
+            ''')
+            
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?", (f"{table}_insert",))
+            if cursor.fetchone() is None:
+                self.rebuild_rollup(cursor, bucket)
+            
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_insert
+            AFTER INSERT ON detections
+            BEGIN
+                INSERT INTO {table} (bucket_start, district_id, detection_type, count, confidence_sum)
+                VALUES ({bucket_start.format(ts="NEW.timestamp")}, NEW.district_id, NEW.detection_type, 1, NEW.confidence)
+                ON CONFLICT (bucket_start, district_id, detection_type) DO UPDATE SET
+                    count = count + 1,
+                    confidence_sum = confidence_sum + excluded.confidence_sum;
+            END
+            ''')
+            
+            cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_delete
+            AFTER DELETE ON detections
+            BEGIN
+                UPDATE {table}
+                SET count = count - 1, confidence_sum = confidence_sum - OLD.confidence
+                WHERE bucket_start = {bucket_start.format(ts="OLD.timestamp")}
+                    AND district_id = OLD.district_id AND detection_type = OLD.detection_type;
+                DELETE FROM {table}
+                WHERE bucket_start = {bucket_start.format(ts="OLD.timestamp")}
+                    AND district_id = OLD.district_id AND detection_type = OLD.detection_type AND count <= 0;
+            END
+            ''')
+        
         # If this is a new database, populate with Uganda districts
         if not db_exists:
             self.populate_uganda_districts(cursor)
@@ -43,6 +257,41 @@ class DetectionDatabase:
         conn.commit()
         conn.close()
     
+    def rebuild_latest_detections(self, cursor):
+        """Recompute latest_detection from the full detections history"""
+        cursor.execute("DELETE FROM latest_detection")
+        # One index seek per district rather than a scan of the whole history
+        cursor.execute('''
+        INSERT INTO latest_detection (district_id, detection_id, detection_type, confidence, timestamp)
+        SELECT detections.district_id, detections.id, detections.detection_type, detections.confidence, detections.timestamp
+        FROM districts
+        JOIN detections ON detections.id = (
+            SELECT id FROM detections
+            WHERE district_id = districts.id
+            ORDER BY timestamp DESC, id DESC
+            LIMIT 1
+        )
+        ''')
+    
+    def rebuild_rollup(self, cursor, bucket):
+        """Recompute one rollup table from the full detections history"""
+        table, bucket_start = ROLLUP_BUCKETS[bucket]
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(f'''
+        INSERT INTO {table} (bucket_start, district_id, detection_type, count, confidence_sum)
+        SELECT {bucket_start.format(ts="timestamp")} AS start, district_id, detection_type, COUNT(*), SUM(confidence)
+        FROM detections
+        GROUP BY start, district_id, detection_type
+        ''')
+    
+    def rebuild_rollups(self):
+        """Recompute every rollup table, e.g. after bulk-loading detections with the triggers dropped"""
+        conn = self.connection()
+        with conn:
+            cursor = conn.cursor()
+            for bucket in ROLLUP_BUCKETS:
+                self.rebuild_rollup(cursor, bucket)
+    
     def populate_uganda_districts(self, cursor):
         """Populate the database with Uganda districts and their coordinates"""
         # This is a simplified list - you should replace with complete and accurate data
@@ -60,35 +309,57 @@ class DetectionDatabase:
             districts
         )
     
+    def get_district_id(self, district_name):
+        """Look up a district's id in the in-memory cache, reloading it when the districts change"""
+        now = time.monotonic()
+        with self.district_ids_lock:
+            if now - self.district_ids_checked_at >= self.district_refresh_interval:
+                version = self.get_districts_version()
+                if version != self.district_ids_version:
+                    self.load_district_ids(version)
+                self.district_ids_checked_at = now
+            
+            district_id = self.district_ids.get(district_name)
+            if district_id is None:
+                # The district may have been added since the last reload
+                self.load_district_ids(self.get_districts_version())
+                district_id = self.district_ids.get(district_name)
+        
+        return district_id
+    
+    def load_district_ids(self, version):
+        """Replace the district name -> id cache"""
+        rows = self.connection().execute("SELECT name, id FROM districts").fetchall()
+        self.district_ids = {row[0]: row[1] for row in rows}
+        self.district_ids_version = version
+    
     def add_detection(self, district_name, detection_type, confidence):
         """Add a new detection to the database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get district ID
-        cursor.execute("SELECT id FROM districts WHERE name = ?", (district_name,))
-        result = cursor.fetchone()
+        district_id = self.get_district_id(district_name)
         
-        if not result:
-            conn.close()
+        if district_id is None:
             raise ValueError(f"District '{district_name}' not found in database")
         
-        district_id = result[0]
-        
         # Insert detection
-        cursor.execute(
+        conn = self.connection()
+        conn.execute(
             "INSERT INTO detections (district_id, detection_type, confidence) VALUES (?, ?, ?)",
             (district_id, detection_type, confidence)
         )
-        
         conn.commit()
-        conn.close()
+    
+    def add_detection_rows(self, rows):
+        """Insert (district_id, detection_type, confidence, timestamp) rows in one transaction"""
+        conn = self.connection()
+        with conn:
+            conn.executemany(
+                "INSERT INTO detections (district_id, detection_type, confidence, timestamp) VALUES (?, ?, ?, ?)",
+                rows
+            )
     
     def get_all_detections(self):
         """Get all detections with district information"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        cursor = self.connection().cursor()
         
         cursor.execute('''
         SELECT 
@@ -104,54 +375,140 @@ class DetectionDatabase:
         ''')
         
         results = [dict(row) for row in cursor.fetchall()]
-        conn.close()
         
         return results
     
     def get_latest_detections_by_district(self):
         """Get the latest detection for each district"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        cursor = self.connection().cursor()
         
         cursor.execute('''
-        WITH LatestDetections AS (
-            SELECT 
-                district_id,
-                MAX(timestamp) as latest_timestamp
-            FROM detections
-            GROUP BY district_id
-        )
         SELECT 
             districts.name as district, 
             districts.latitude, 
             districts.longitude, 
-            detections.detection_type, 
-            detections.confidence,
-            detections.timestamp
-        FROM detections
-        JOIN LatestDetections ON 
-            detections.district_id = LatestDetections.district_id AND
-            detections.timestamp = LatestDetections.latest_timestamp
-        JOIN districts ON detections.district_id = districts.id
+            latest_detection.detection_type, 
+            latest_detection.confidence,
+            latest_detection.timestamp
+        FROM latest_detection
+        JOIN districts ON latest_detection.district_id = districts.id
         ''')
         
         results = [dict(row) for row in cursor.fetchall()]
-        conn.close()
         
         return results
     
+    def get_latest_detections_since(self, detection_id):
+        """Get the districts whose latest detection is newer than detection_id, oldest first"""
+        cursor = self.connection().cursor()
+        
+        cursor.execute('''
+        SELECT 
+            latest_detection.detection_id,
+            districts.name as district, 
+            districts.latitude, 
+            districts.longitude, 
+            latest_detection.detection_type, 
+            latest_detection.confidence,
+            latest_detection.timestamp
+        FROM latest_detection
+        JOIN districts ON latest_detection.district_id = districts.id
+        WHERE latest_detection.detection_id > ?
+        ORDER BY latest_detection.detection_id
+        ''', (detection_id or 0,))
+        
+        results = [dict(row) for row in cursor.fetchall()]
+        
+        return results
+    
+    def get_latest_detection_id(self):
+        """Get the id of the newest detection that is some district's latest, 0 when there are none"""
+        cursor = self.connection().cursor()
+        cursor.execute("SELECT MAX(detection_id) FROM latest_detection")
+        result = cursor.fetchone()
+        
+        return result[0] or 0
+    
+    def get_detection_counts(self, bucket="day", since=None, until=None, detection_type=None):
+        """
+        Get detection counts per district and type for each time bucket.
+        
+        since and until are ISO 8601 dates or datetimes (UTC unless they
+        carry an offset). The bucket containing since is included, until is
+        exclusive. Raises ValueError for an unknown bucket or a bad date.
+        """
+        if bucket not in ROLLUP_BUCKETS:
+            raise ValueError(f"Unknown bucket '{bucket}', expected one of: {', '.join(ROLLUP_BUCKETS)}")
+        table, bucket_start = ROLLUP_BUCKETS[bucket]
+        
+        conditions = []
+        params = []
+        if since:
+            conditions.append(f"{table}.bucket_start >= {bucket_start.format(ts='?')}")
+            params.append(self.parse_timestamp(since))
+        if until:
+            conditions.append(f"{table}.bucket_start < ?")
+            params.append(self.parse_timestamp(until))
+        if detection_type:
+            conditions.append(f"{table}.detection_type = ?")
+            params.append(detection_type)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        
+        cursor = self.connection().cursor()
+        cursor.execute(f'''
+        SELECT 
+            {table}.bucket_start,
+            districts.name as district,
+            {table}.detection_type,
+            {table}.count,
+            {table}.confidence_sum / {table}.count as average_confidence
+        FROM {table}
+        JOIN districts ON {table}.district_id = districts.id
+        {where}
+        ORDER BY {table}.bucket_start, districts.name, {table}.detection_type
+        ''', params)
+        
+        results = [dict(row) for row in cursor.fetchall()]
+        
+        return results
+    
+    def parse_timestamp(self, value):
+        """Normalise an ISO 8601 date or datetime to the UTC format detections are stored in"""
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            raise ValueError(f"Invalid date '{value}', expected ISO 8601 such as 2025-03-01 or 2025-03-01T06:00:00")
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc)
+        return parsed.strftime('%Y-%m-%d %H:%M:%S')
+    
     def get_all_districts(self):
         """Get all districts with their coordinates"""
-        cursor = self.conn.cursor()
+        cursor = self.connection().cursor()
         cursor.execute("SELECT name, latitude, longitude FROM districts")
     
         districts = []
         for row in cursor.fetchall():
-         districts.append({
-            'name': row[0],
-            'latitude': row[1],
-            'longitude': row[2]
-        })
+            districts.append({
+                'name': row[0],
+                'latitude': row[1],
+                'longitude': row[2]
+            })
     
         return districts
+    
+    def get_districts_version(self):
+        """Get the counter that changes whenever the districts table changes"""
+        cursor = self.connection().cursor()
+        cursor.execute("SELECT value FROM meta WHERE key = 'districts_version'")
+        result = cursor.fetchone()
+        
+        return result[0] if result else 0
+    
+    def get_data_versions(self):
+        """Get the districts and detections version counters as one (districts, data) pair"""
+        cursor = self.connection().cursor()
+        cursor.execute("SELECT key, value FROM meta WHERE key IN ('districts_version', 'data_version')")
+        versions = {row[0]: row[1] for row in cursor.fetchall()}
+        
+        return versions.get('districts_version', 0), versions.get('data_version', 0)
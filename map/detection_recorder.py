@@ -0,0 +1,216 @@
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+
+class DetectionRecorder:
+    """
+    Write-behind recorder for detections.
+
+    add_detection() resolves the district, stamps the row with the time of
+    the request and puts it on a bounded queue, so the request does not
+    wait for a commit. A writer thread flushes the queue with one
+    executemany() transaction once flush_size rows are waiting or
+    flush_interval_ms has passed since the first of them.
+
+    When the queue is full add_detection() waits up to put_timeout seconds
+    for room and then writes the row itself, so a slow disk slows requests
+    down instead of losing detections. A flush that fails is retried with
+    backoff, then written row by row, so only rows the database rejects on
+    their own are dropped (and counted in rows_failed).
+
+    The writer thread starts with the first detection. A process forked
+    from this one, e.g. a gunicorn worker of a preloaded app, starts over
+    with an empty queue and starts its own writer the same way.
+    """
+    def __init__(self, db, max_queue_size=10000, flush_size=256, flush_interval_ms=200, put_timeout=1.0,
+                 retries=3, retry_delay=0.1):
+        self.db = db
+        self.max_queue_size = max_queue_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.put_timeout = put_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.closed = False
+        self.reset()
+        # fork() copies the queue but not the writer thread; rows the parent
+        # had queued are the parent's to write
+        os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        """Empty queue, zeroed statistics and no writer thread yet"""
+        self.queue = queue.Queue(maxsize=self.max_queue_size)
+        self.lock = threading.Lock()
+        # Held while checking closed and queueing a row, and by close() while
+        # it queues the stop marker, so no row can land behind the marker
+        self.put_lock = threading.Lock()
+        self.thread = None
+        self.rows_queued = 0
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.flushes = 0
+        self.flush_retries = 0
+        self.flush_seconds = 0.0
+        self.max_queue_depth = 0
+        self.blocked_puts = 0
+        self.blocked_seconds = 0.0
+        self.sync_writes = 0
+
+    def start(self):
+        """Start the writer thread in this process; the caller holds put_lock"""
+        self.thread = threading.Thread(target=self.run, name="detection-recorder", daemon=True)
+        self.thread.start()
+
+    def add_detection(self, district_name, detection_type, confidence):
+        """Queue a detection; same arguments and errors as DetectionDatabase.add_detection()"""
+        district_id = self.db.get_district_id(district_name)
+        if district_id is None:
+            raise ValueError(f"District '{district_name}' not found in database")
+
+        # Same format as SQLite's CURRENT_TIMESTAMP, taken now rather than at flush time
+        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        row = (district_id, detection_type, confidence, timestamp)
+
+        with self.put_lock:
+            queued = False
+            if not self.closed:
+                if self.thread is None:
+                    self.start()
+                queued = self.put(row)
+        if not queued:
+            self.write_now(row)
+
+    def put(self, row):
+        """Queue a row, waiting up to put_timeout for room; False when it did not fit"""
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            started = time.monotonic()
+            try:
+                self.queue.put(row, timeout=self.put_timeout)
+                queued = True
+            except queue.Full:
+                queued = False
+            with self.lock:
+                self.blocked_puts += 1
+                self.blocked_seconds += time.monotonic() - started
+            if not queued:
+                return False
+
+        with self.lock:
+            self.rows_queued += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return True
+
+    def write_now(self, row):
+        """Write a row on the caller's thread when the queue cannot take it"""
+        self.db.add_detection_rows([row])
+        with self.lock:
+            self.sync_writes += 1
+
+    def run(self):
+        """Writer loop: wait for a first row, then collect more until the batch is full or the interval expires"""
+        while True:
+            first = self.queue.get()
+            if first is None:
+                self.queue.task_done()
+                break
+
+            batch = [first]
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    row = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if row is None:
+                    # Write what we have, then exit
+                    self.queue.task_done()
+                    stop = True
+                    break
+                batch.append(row)
+
+            self.write_batch(batch)
+            for _ in batch:
+                self.queue.task_done()
+            if stop:
+                break
+
+    def write_batch(self, batch):
+        """Insert a batch of rows in one transaction, retrying and then falling back to one row at a time"""
+        started = time.monotonic()
+        failed = 0
+        for attempt in range(self.retries + 1):
+            try:
+                self.db.add_detection_rows(batch)
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    print(f"Recording {len(batch)} detections failed {attempt + 1} times, writing them one by one: {e}")
+                    failed = self.write_rows(batch)
+                    break
+                with self.lock:
+                    self.flush_retries += 1
+                # e.g. "database is locked" while another process holds a long write
+                time.sleep(self.retry_delay * 2 ** attempt)
+
+        with self.lock:
+            self.flushes += 1
+            self.flush_seconds += time.monotonic() - started
+            self.rows_written += len(batch) - failed
+            self.rows_failed += failed
+
+    def write_rows(self, rows):
+        """Insert rows one by one, so one the database rejects does not take the rest with it; returns how many failed"""
+        failed = 0
+        for row in rows:
+            try:
+                self.db.add_detection_rows([row])
+            except Exception as e:
+                print(f"Dropping detection {row}: {e}")
+                failed += 1
+        return failed
+
+    def flush(self):
+        """Block until every row queued so far has been written"""
+        self.queue.join()
+
+    def get_stats(self):
+        """Return queue and flush statistics"""
+        with self.lock:
+            flushes = self.flushes
+            return {
+                "queue_depth": self.queue.qsize(),
+                "queue_capacity": self.queue.maxsize,
+                "max_queue_depth": self.max_queue_depth,
+                "rows_queued": self.rows_queued,
+                "rows_written": self.rows_written,
+                "rows_failed": self.rows_failed,
+                "flushes": flushes,
+                "flush_retries": self.flush_retries,
+                "average_flush_size": self.rows_written / flushes if flushes else 0.0,
+                "average_flush_ms": self.flush_seconds / flushes * 1000 if flushes else 0.0,
+                "blocked_puts": self.blocked_puts,
+                "blocked_ms": self.blocked_seconds * 1000,
+                "sync_writes": self.sync_writes
+            }
+
+    def close(self):
+        """Write out everything still queued and stop the writer thread"""
+        with self.put_lock:
+            if self.closed:
+                return
+            self.closed = True
+            thread = self.thread
+            if thread is not None:
+                # Rows queued before this are written; later ones are written directly
+                self.queue.put(None)
+        if thread is not None:
+            thread.join()
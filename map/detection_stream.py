@@ -0,0 +1,195 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+
+# Idle streams get a comment line this often so proxies keep them open
+HEARTBEAT_SECONDS = 15
+
+
+def format_event(row):
+    """Format a latest-detection row as a Server-Sent Event, using the detection id as the event id"""
+    return f"id: {row['detection_id']}\nevent: detection\ndata: {json.dumps(row, separators=(',', ':'))}\n\n"
+
+
+def parse_event_id(value):
+    """Read a Last-Event-ID value; anything missing or malformed starts from the beginning"""
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class DetectionBroker:
+    """
+    Fans out district state changes to every open /api/detections/stream.
+
+    One thread per process watches the data version counter and, when it
+    moves, reads the districts whose latest detection is newer than the
+    last one it has seen. Subscribers are woken from that shared feed, so
+    open dashboards cost nothing per refresh. Events carry the detection
+    id, so a client reconnecting with Last-Event-ID gets only the districts
+    that changed since, from the in-memory history or, when it has fallen
+    further behind, from the latest_detection table.
+    """
+    def __init__(self, db, poll_interval=1.0, history=1000):
+        self.db = db
+        self.poll_interval = poll_interval
+
+        self.events = deque(maxlen=history)
+        self.history_start = None
+        self.last_id = None
+        self.version = None
+        self.condition = threading.Condition()
+        self.wakeup = threading.Event()
+        self.async_waiters = set()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.polls = 0
+        self.published = 0
+
+    def start(self):
+        """Start the polling thread on first use"""
+        with self.lock:
+            if self.thread is None:
+                self.last_id = self.db.get_latest_detection_id()
+                self.history_start = self.last_id
+                self.version = self.db.get_data_versions()
+                self.thread = threading.Thread(target=self.run, name="detection-broker", daemon=True)
+                self.thread.start()
+
+    def notify(self):
+        """Check for new detections now instead of at the next poll, e.g. right after recording one"""
+        self.wakeup.set()
+
+    def run(self):
+        """Poll the data version and publish districts whose latest detection changed"""
+        while True:
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+            try:
+                version = self.db.get_data_versions()
+                self.polls += 1
+                if version != self.version:
+                    self.version = version
+                    self.publish(self.db.get_latest_detections_since(self.last_id))
+            except Exception as e:
+                print(f"Detection stream poll failed: {e}")
+
+    def publish(self, rows):
+        """Append new rows to the history and wake every subscriber"""
+        if not rows:
+            return
+
+        with self.condition:
+            for row in rows:
+                if len(self.events) == self.events.maxlen:
+                    # The oldest event falls out of the history
+                    self.history_start = self.events[0]['detection_id']
+                self.events.append(row)
+            self.last_id = rows[-1]['detection_id']
+            self.published += len(rows)
+            self.condition.notify_all()
+            waiters = list(self.async_waiters)
+
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def history_after(self, event_id):
+        """Rows newer than event_id from memory, or None when the history does not reach back that far"""
+        with self.condition:
+            if event_id >= self.last_id:
+                return []
+            if event_id >= self.history_start:
+                return [row for row in self.events if row['detection_id'] > event_id]
+        return None
+
+    def events_after(self, event_id):
+        """Rows newer than event_id, falling back to the latest_detection table"""
+        rows = self.history_after(event_id)
+        return rows if rows is not None else self.db.get_latest_detections_since(event_id)
+
+    def wait(self, event_id, timeout=HEARTBEAT_SECONDS):
+        """Block until there are rows newer than event_id or the timeout passes"""
+        self.start()
+        with self.condition:
+            self.condition.wait_for(lambda: self.last_id > event_id, timeout=timeout)
+        return self.events_after(event_id)
+
+    async def wait_async(self, event_id, timeout=HEARTBEAT_SECONDS):
+        """Like wait(), for asyncio handlers; only the database fallback leaves the event loop"""
+        self.start()
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self.condition:
+            self.async_waiters.add(waiter)
+            ready = self.last_id > event_id
+        try:
+            if not ready:
+                try:
+                    await asyncio.wait_for(event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self.condition:
+                self.async_waiters.discard(waiter)
+        rows = self.history_after(event_id)
+        if rows is None:
+            rows = await asyncio.get_running_loop().run_in_executor(None, self.db.get_latest_detections_since, event_id)
+        return rows
+
+    def get_stats(self):
+        """Return polling and fan-out statistics"""
+        with self.condition:
+            return {
+                "polls": self.polls,
+                "published": self.published,
+                "history": len(self.events),
+                "async_subscribers": len(self.async_waiters),
+                "last_event_id": self.last_id
+            }
+
+
+def event_stream(broker, event_id=0, max_seconds=None, retry_ms=5000):
+    """
+    Generate the SSE body for one subscriber: every district changed after
+    event_id (all of them for a new subscriber), then each change as the
+    broker publishes it. With max_seconds the stream ends after that long
+    and the browser reconnects after retry_ms, resuming from Last-Event-ID,
+    so a sync worker is never held past its timeout
+    """
+    yield f"retry: {retry_ms}\n\n"
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    broker.start()
+    rows = broker.events_after(event_id)
+    while True:
+        if rows:
+            for row in rows:
+                yield format_event(row)
+            event_id = max(event_id, rows[-1]['detection_id'])
+        else:
+            yield ": keepalive\n\n"
+        if deadline is None:
+            rows = broker.wait(event_id)
+            continue
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        rows = broker.wait(event_id, timeout=min(HEARTBEAT_SECONDS, remaining))
+
+
+async def event_stream_async(broker, event_id=0):
+    """event_stream() for asyncio servers"""
+    yield "retry: 5000\n\n"
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, broker.start)
+    rows = await loop.run_in_executor(None, broker.events_after, event_id)
+    while True:
+        if rows:
+            for row in rows:
+                yield format_event(row)
+            event_id = max(event_id, rows[-1]['detection_id'])
+        else:
+            yield ": keepalive\n\n"
+        rows = await broker.wait_async(event_id)
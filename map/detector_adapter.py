@@ -1,16 +1,54 @@
-from model_utils import detector
+import os
+import atexit
+from model_utils import get_detector
 from map.database_schema import DetectionDatabase
-import math
+from map.district_index import DistrictIndex
+from map.district_boundaries import DistrictBoundaries, DEFAULT_BOUNDARIES_PATH
+from map.detection_recorder import DetectionRecorder
+from map.detection_stream import DetectionBroker
 
 class DetectorAdapter:
-    def __init__(self):
+    def __init__(self, detection_service=None):
         self.db = DetectionDatabase()
+        self.district_index = DistrictIndex(self.db)
+        # District polygons, when a boundary file is available; otherwise GPS
+        # fixes are matched to the nearest district centroid
+        boundaries_path = os.environ.get('FAW_DISTRICT_BOUNDARIES', DEFAULT_BOUNDARIES_PATH)
+        self.boundaries = DistrictBoundaries.from_geojson(boundaries_path) if os.path.exists(boundaries_path) else None
+        if self.boundaries is not None:
+            unknown = sorted({shape.name for shape in self.boundaries.shapes if self.db.get_district_id(shape.name) is None})
+            if unknown:
+                print(f"District boundaries not in the districts table, using the nearest centroid there instead: {', '.join(unknown)}")
+        # Anything with a detect() method, e.g. a DetectorPool or BatchScheduler;
+        # falls back to the shared detector, loaded on first use
+        self.detector = detection_service
+        
+        # Pushes district updates to /api/detections/stream subscribers;
+        # its polling thread starts with the first subscriber
+        self.detection_stream = DetectionBroker(self.db)
+        
+        # Optionally record detections in the background, committing them in groups
+        self.recorder = None
+        if os.environ.get('FAW_RECORD_ASYNC') == '1':
+            self.recorder = DetectionRecorder(
+                self.db,
+                max_queue_size=int(os.environ.get('FAW_RECORD_QUEUE_SIZE', '10000')),
+                flush_size=int(os.environ.get('FAW_RECORD_FLUSH_SIZE', '256')),
+                flush_interval_ms=float(os.environ.get('FAW_RECORD_FLUSH_MS', '200'))
+            )
+            atexit.register(self.close)
     
-    def detect_and_record(self, image_path, district_name):
-        """Run detection and record the result with location data"""
+    def detect_and_record(self, image, district_name):
+        """Run detection on an image (path, encoded bytes or ndarray) and record the result with location data"""
         # Run the detection using your existing detector
-        detection_result = detector.detect(image_path)
+        detection_result = (self.detector or get_detector()).detect(image)
         
+        self.record_detection(detection_result, district_name)
+        
+        return detection_result
+    
+    def record_detection(self, detection_result, district_name):
+        """Record a detection result that has already been computed against a district"""
         # Extract the detection type
         if "result" in detection_result:
             result_text = detection_result["result"]
@@ -29,39 +67,51 @@ class DetectorAdapter:
             
             # Record in database
             confidence = detection_result.get("confidence", 0) / 100.0  # Convert from percentage
-            self.db.add_detection(
+            (self.recorder or self.db).add_detection(
                 district_name=district_name,
                 detection_type=detection_type,
                 confidence=confidence
             )
-        
-        return detection_result
+            if self.recorder is None:
+                # Committed already, so stream subscribers can have it straight away
+                self.detection_stream.notify()
     
     def get_detection_map_data(self):
         """Get data for the detection map"""
         return self.db.get_latest_detections_by_district()
     
+    def get_detection_trends(self, bucket="day", since=None, until=None, detection_type=None):
+        """Get detection counts per district and type for each hour, day or week"""
+        return self.db.get_detection_counts(bucket=bucket, since=since, until=until, detection_type=detection_type)
+    
     def get_all_districts(self):
         """Get all districts for the map"""
         return self.db.get_all_districts()
     
+    def get_data_versions(self):
+        """Get the (districts, detections) version counters, which change whenever the map data does"""
+        return self.db.get_data_versions()
+    
     def find_nearest_district(self, latitude, longitude):
         """Find the nearest district based on GPS coordinates"""
-        districts = self.db.get_all_districts()
-        
-        if not districts:
-            return None
-        
-        # Calculate distance to each district
-        nearest_district = None
-        min_distance = float('inf')
-        
-        for district in districts:
-            # Simple Euclidean distance (not perfect for Earth coordinates but sufficient for this purpose)
-            dist = math.sqrt((district['latitude'] - latitude)**2 + (district['longitude'] - longitude)**2)
-            
-            if dist < min_distance:
-                min_distance = dist
-                nearest_district = district['name']
-        
-        return nearest_district
+        return self.district_index.nearest(latitude, longitude)
+    
+    def find_nearest_districts(self, latitudes, longitudes):
+        """Find the nearest district for arrays of GPS coordinates"""
+        names, distances = self.district_index.lookup(latitudes, longitudes)
+        return list(names)
+    
+    def find_district(self, latitude, longitude):
+        """Find the district containing the GPS coordinates, falling back to the nearest centroid"""
+        if self.boundaries is not None:
+            district = self.boundaries.find_district(latitude, longitude)
+            # Only names the districts table knows can be recorded
+            if district and self.db.get_district_id(district) is not None:
+                return district
+        return self.find_nearest_district(latitude, longitude)
+    
+    def close(self):
+        """Write out queued detections and close the database connections"""
+        if self.recorder is not None:
+            self.recorder.close()
+        self.db.close()
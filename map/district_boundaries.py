@@ -0,0 +1,156 @@
+import json
+import os
+import numpy as np
+
+# Official district boundaries as GeoJSON (Polygon or MultiPolygon features,
+# [longitude, latitude] coordinates). Feature names must match the names in
+# the districts table so detections can be recorded against them
+DEFAULT_BOUNDARIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'uganda_districts.geojson')
+
+# Property names commonly used for the district name in boundary datasets
+NAME_PROPERTIES = ['name', 'NAME', 'District', 'DISTRICT', 'DName2019', 'ADM2_EN', 'shapeName']
+
+
+def feature_rings(geometry):
+    """Return every ring (outer boundaries and holes) of a Polygon or MultiPolygon geometry"""
+    if geometry['type'] == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    else:
+        raise ValueError(f"Unsupported geometry type: {geometry['type']}")
+    return [np.asarray(ring, dtype=np.float64)[:, :2] for polygon in polygons for ring in polygon]
+
+
+class DistrictShape:
+    """The edges and bounding box of one district, ready for point-in-polygon tests"""
+    def __init__(self, name, rings):
+        self.name = name
+
+        # Flatten every ring into one edge list. Counting crossings over all
+        # of them at once gives holes and multi-part districts for free: a
+        # point inside a hole crosses the outer ring and the hole, an even count
+        x1, y1, x2, y2 = [], [], [], []
+        for ring in rings:
+            if len(ring) < 3:
+                continue
+            following = np.roll(ring, -1, axis=0)
+            x1.append(ring[:, 0])
+            y1.append(ring[:, 1])
+            x2.append(following[:, 0])
+            y2.append(following[:, 1])
+        self.x1 = np.concatenate(x1)
+        self.y1 = np.concatenate(y1)
+        self.x2 = np.concatenate(x2)
+        self.y2 = np.concatenate(y2)
+
+        self.min_x = min(self.x1.min(), self.x2.min())
+        self.max_x = max(self.x1.max(), self.x2.max())
+        self.min_y = min(self.y1.min(), self.y2.min())
+        self.max_y = max(self.y1.max(), self.y2.max())
+
+    def contains(self, xs, ys):
+        """Even-odd ray casting for arrays of points; returns a boolean mask"""
+        xs = xs[:, None]
+        ys = ys[:, None]
+        straddles = (self.y1 > ys) != (self.y2 > ys)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing_x = self.x1 + (ys - self.y1) * (self.x2 - self.x1) / (self.y2 - self.y1)
+        crossings = np.count_nonzero(straddles & (xs < crossing_x), axis=1)
+        return crossings % 2 == 1
+
+
+class DistrictBoundaries:
+    """
+    Point-in-polygon district lookup backed by a uniform grid.
+
+    Each grid cell lists the districts whose bounding box overlaps it, so a
+    lookup only runs the ray-casting test on the two or three polygons near
+    the point instead of every district in the country.
+    """
+    def __init__(self, shapes, cell_size=0.1):
+        self.shapes = shapes
+        self.cell_size = cell_size
+
+        if shapes:
+            self.origin_x = min(shape.min_x for shape in shapes)
+            self.origin_y = min(shape.min_y for shape in shapes)
+            self.columns = int((max(shape.max_x for shape in shapes) - self.origin_x) // cell_size) + 1
+            self.rows = int((max(shape.max_y for shape in shapes) - self.origin_y) // cell_size) + 1
+        else:
+            self.origin_x = self.origin_y = 0.0
+            self.columns = self.rows = 0
+
+        self.grid = {}
+        for index, shape in enumerate(shapes):
+            first_column, first_row = self.cell_of(shape.min_x, shape.min_y)
+            last_column, last_row = self.cell_of(shape.max_x, shape.max_y)
+            for column in range(first_column, last_column + 1):
+                for row in range(first_row, last_row + 1):
+                    self.grid.setdefault(column * self.rows + row, []).append(index)
+
+    @classmethod
+    def from_geojson(cls, path=DEFAULT_BOUNDARIES_PATH, name_property=None, cell_size=0.1):
+        """Load district polygons from a GeoJSON FeatureCollection"""
+        with open(path) as f:
+            collection = json.load(f)
+
+        shapes = []
+        for feature in collection['features']:
+            properties = feature.get('properties') or {}
+            key = name_property or next((k for k in NAME_PROPERTIES if k in properties), None)
+            if key is None or not feature.get('geometry'):
+                continue
+            shapes.append(DistrictShape(str(properties[key]).strip(), feature_rings(feature['geometry'])))
+
+        print(f"Loaded {len(shapes)} district boundaries from {path}")
+        return cls(shapes, cell_size=cell_size)
+
+    def cell_of(self, x, y):
+        """Grid column and row for a coordinate"""
+        return int((x - self.origin_x) // self.cell_size), int((y - self.origin_y) // self.cell_size)
+
+    def lookup(self, latitudes, longitudes):
+        """
+        Find the district containing each point.
+
+        Returns an object array of names, None for points outside every
+        district (e.g. in a lake or outside the country).
+        """
+        ys = np.atleast_1d(np.asarray(latitudes, dtype=np.float64))
+        xs = np.atleast_1d(np.asarray(longitudes, dtype=np.float64))
+        names = np.full(len(xs), None, dtype=object)
+        if not self.shapes:
+            return names
+
+        columns = np.floor((xs - self.origin_x) / self.cell_size).astype(np.int64)
+        rows = np.floor((ys - self.origin_y) / self.cell_size).astype(np.int64)
+        on_grid = (columns >= 0) & (columns < self.columns) & (rows >= 0) & (rows < self.rows)
+        cells = np.where(on_grid, columns * self.rows + rows, -1)
+
+        # Test the points of each cell together against that cell's candidates
+        for cell in np.unique(cells[on_grid]):
+            pending = np.flatnonzero(cells == cell)
+            for index in self.grid.get(int(cell), []):
+                shape = self.shapes[index]
+                inside = shape.contains(xs[pending], ys[pending])
+                names[pending[inside]] = shape.name
+                pending = pending[~inside]
+                if len(pending) == 0:
+                    break
+
+        return names
+
+    def find_district(self, latitude, longitude):
+        """Name of the district containing a single GPS fix, or None"""
+        column, row = self.cell_of(longitude, latitude)
+        if not (0 <= column < self.columns and 0 <= row < self.rows):
+            return None
+
+        xs = np.array([longitude], dtype=np.float64)
+        ys = np.array([latitude], dtype=np.float64)
+        for index in self.grid.get(column * self.rows + row, []):
+            shape = self.shapes[index]
+            if shape.min_x <= longitude <= shape.max_x and shape.min_y <= latitude <= shape.max_y and shape.contains(xs, ys)[0]:
+                return shape.name
+        return None
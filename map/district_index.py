@@ -0,0 +1,94 @@
+import threading
+import time
+import numpy as np
+from scipy.spatial import cKDTree
+
+# Mean Earth radius in kilometres
+EARTH_RADIUS_KM = 6371.0088
+
+
+def to_unit_vectors(latitudes, longitudes):
+    """Convert lat/lon in degrees to points on the unit sphere"""
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def chord_to_km(chord):
+    """Convert a straight-line distance between unit vectors to a great-circle distance"""
+    return 2.0 * np.arcsin(np.clip(chord / 2.0, 0.0, 1.0)) * EARTH_RADIUS_KM
+
+
+class DistrictIndex:
+    """
+    In-memory nearest-district index over the district centroids.
+
+    Centroids are stored as unit vectors in a KD-tree. The straight-line
+    distance between two points on the sphere grows with their great-circle
+    (haversine) distance, so the nearest neighbour in the tree is the nearest
+    district on the ground. The index reloads from the database when the
+    districts version counter changes, checking at most every
+    refresh_interval seconds.
+    """
+    def __init__(self, db, refresh_interval=5.0):
+        self.db = db
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self.version = None
+        self.checked_at = 0.0
+        self.names = np.array([], dtype=object)
+        self.latitudes = np.array([], dtype=np.float64)
+        self.longitudes = np.array([], dtype=np.float64)
+        self.tree = None
+
+    def refresh(self, force=False):
+        """Reload the centroids if the districts table has changed"""
+        now = time.monotonic()
+        if not force and now - self.checked_at < self.refresh_interval:
+            return
+
+        with self.lock:
+            if not force and now - self.checked_at < self.refresh_interval:
+                return
+
+            version = self.db.get_districts_version()
+            if force or version != self.version:
+                districts = self.db.get_all_districts()
+                names = np.array([d['name'] for d in districts], dtype=object)
+                latitudes = np.array([d['latitude'] for d in districts], dtype=np.float64)
+                longitudes = np.array([d['longitude'] for d in districts], dtype=np.float64)
+                tree = cKDTree(to_unit_vectors(latitudes, longitudes)) if districts else None
+
+                # Swap everything in together so lookups never see a half-built index
+                self.names, self.latitudes, self.longitudes, self.tree = names, latitudes, longitudes, tree
+                self.version = version
+
+            self.checked_at = now
+
+    def invalidate(self):
+        """Force a reload on the next lookup"""
+        self.checked_at = 0.0
+        self.version = None
+
+    def lookup(self, latitudes, longitudes):
+        """
+        Find the nearest district for arrays of coordinates.
+
+        Returns (names, distances_km) as arrays of the same length as the
+        input; names are None when there are no districts.
+        """
+        self.refresh()
+        names, tree = self.names, self.tree
+
+        points = to_unit_vectors(np.atleast_1d(latitudes), np.atleast_1d(longitudes))
+        if tree is None:
+            return np.full(len(points), None, dtype=object), np.full(len(points), np.inf)
+
+        chords, indices = tree.query(points)
+        return names[indices], chord_to_km(chords)
+
+    def nearest(self, latitude, longitude):
+        """Find the name of the district nearest to a single GPS fix"""
+        names, distances = self.lookup([latitude], [longitude])
+        return names[0]
@@ -0,0 +1,126 @@
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    # Optional: without it responses are offered as gzip or uncompressed
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed, compression would not pay off
+MIN_COMPRESS_BYTES = 512
+
+
+class CachedBody:
+    """One serialised JSON response with its precompressed variants and ETags"""
+    def __init__(self, version, data):
+        self.version = version
+        body = json.dumps(data, separators=(',', ':')).encode()
+        tag = hashlib.blake2b(body, digest_size=16).hexdigest()
+
+        # Each encoding is a different byte sequence, so each gets its own strong ETag
+        self.variants = {None: (body, f'"{tag}"')}
+        if len(body) >= MIN_COMPRESS_BYTES:
+            self.variants['gzip'] = (gzip.compress(body, compresslevel=6, mtime=0), f'"{tag}-gzip"')
+            if brotli is not None:
+                self.variants['br'] = (brotli.compress(body, quality=5), f'"{tag}-br"')
+        self.etags = {etag for _, etag in self.variants.values()}
+
+
+def accepted_encodings(accept_encoding):
+    """Parse an Accept-Encoding header into the set of codings the client accepts"""
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            accepted.add(coding)
+    return accepted
+
+
+def etag_matches(if_none_match, etags):
+    """True when an If-None-Match header names any of the given ETags"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag.strip() in etags for tag in if_none_match.split(','))
+
+
+class ResponseCache:
+    """
+    Serialised and compressed JSON bodies for the map endpoints.
+
+    Each entry is stored with the data version it was built from and is
+    rebuilt only when the version changes, so repeated polls skip the
+    query, json.dumps and gzip. respond() also answers conditional GETs,
+    so a client whose copy is still current gets an empty 304.
+    """
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.builds = 0
+        self.not_modified = 0
+
+    def get(self, key, version, build):
+        """Return the cached body for key, calling build() for fresh data when the version has changed"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.version == version:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+            # Built under the lock so simultaneous polls do not all run the query
+            entry = CachedBody(version, build())
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.builds += 1
+            return entry
+
+    def respond(self, key, version, build, if_none_match=None, accept_encoding=None):
+        """Return (status, body, headers) for a GET of the cached JSON resource"""
+        entry = self.get(key, version, build)
+
+        accepted = accepted_encodings(accept_encoding)
+        encoding = next((e for e in ('br', 'gzip') if e in entry.variants and e in accepted), None)
+        body, etag = entry.variants[encoding]
+
+        # Clients may cache the body but must check back with the ETag before reusing it
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+
+        if etag_matches(if_none_match, entry.etags):
+            with self.lock:
+                self.not_modified += 1
+            return 304, b'', headers
+
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+        return 200, body, headers
+
+    def get_stats(self):
+        """Return cache statistics"""
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "builds": self.builds,
+                "not_modified": self.not_modified
+            }
@@ -1,4 +1,4 @@
-from model_utils import detector
+from model_utils import get_detector
 from database_schema import DetectionDatabase
 
 class LocationAwareDetector:
@@ -8,7 +8,7 @@ class LocationAwareDetector:
     def detect_and_record(self, image_path, district_name):
         """Run detection and record the result with location data"""
         # Run the detection using your existing detector
-        detection_result = detector.detect(image_path)
+        detection_result = get_detector().detect(image_path)
         
         # Extract the detection type
         if "result" in detection_result:
@@ -1,13 +1,16 @@
-import tensorflow.lite as tflite
 import numpy as np
 import json
-import cv2
 import os
+import hashlib
+import threading
 from maize_leaf_detector import MaizeLeafClassifier
+from image_utils import SharedPreprocessor
+from inference_backend import ModelInterpreters, invoke_in_place, dequantize
 
 # Define constants
 IMG_SIZE = 320
-MODEL_PATH = "fall_armyworm_detector.tflite"
+# FAW_DETECTOR_MODEL points at another build of the detector, e.g. a quantized one
+MODEL_PATH = os.environ.get("FAW_DETECTOR_MODEL", "fall_armyworm_detector.tflite")
 
 # Load class map
 with open("class_map.json", "r") as f:
@@ -16,127 +19,210 @@ with open("class_map.json", "r") as f:
 # Reverse mapping from index to class name
 IDX_TO_CLASS = {i: class_name for class_name, i in CLASS_MAP.items()}
 
+# Order in which detected classes decide the final result
+FINAL_CLASS_PRIORITY = ["fall-armyworm-larval-damage", "fall-armyworm-egg", "healthy-maize", "fall-armyworm-frass"]
+
+def get_model_version(*model_paths):
+    """Fingerprint the model files, so cached results are dropped when a model changes"""
+    digest = hashlib.blake2b(digest_size=8)
+    for model_path in model_paths:
+        with open(model_path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
 class FallArmywormDetector:
-    def __init__(self):
+    def __init__(self, model_path=None, classifier_path=None):
+        self.model_path = model_path or MODEL_PATH
+
         # Initialize maize leaf classifier
-        self.maize_classifier = MaizeLeafClassifier()
+        self.maize_classifier = MaizeLeafClassifier(classifier_path)
         
         # Load the TFLite model
-        self.interpreter = tflite.Interpreter(model_path=MODEL_PATH)
-        self.interpreter.allocate_tensors()
+        self.interpreters = ModelInterpreters(self.model_path, "detector")
+        self.interpreter = self.interpreters.interpreter
 
         # Get input and output details
         self.input_details = self.interpreter.get_input_details()
         self.output_details = self.interpreter.get_output_details()
-
-        print("TFLite model size:", os.path.getsize(MODEL_PATH) / (1024 * 1024), "MB")
-
-    def preprocess_image(self, image_path):
-        """Preprocess the image for the model"""
-        # Read image
-        image = cv2.imread(image_path)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB) # Convert BGR to RGB
-
-        # Resize image to model input size
-        image = cv2.resize(image, (IMG_SIZE, IMG_SIZE))
-
-        # Normalize pixel values
-        image = image.astype(np.float32) / 255.0
-
-        # Add batch dimension
-        image = np.expand_dims(image, axis=0)
-
-        return image
-
-    def detect(self, image_path):
-        """Run detection on an image"""
-        # First, check if the image is a maize leaf
-        maize_result = self.maize_classifier.classify(image_path)
+        self.boxes_index, self.classes_index, self.scores_index = self.resolve_output_layout()
+        self.output_indices = [output['index'] for output in self.output_details]
+
+        # Decode and colour-convert each image once for both models, producing
+        # each model's input dtype (float32, or uint8/int8 for quantized variants)
+        self.preprocessor = SharedPreprocessor({
+            "classifier": self.maize_classifier.input_shape,
+            "detector": (IMG_SIZE, IMG_SIZE)
+        }, {
+            "classifier": self.maize_classifier.input_details[0],
+            "detector": self.input_details[0]
+        })
+
+        self.model_version = get_model_version(self.model_path, self.maize_classifier.model_path)
+
+        print("TFLite model size:", os.path.getsize(self.model_path) / (1024 * 1024), "MB")
+
+    def detect(self, image):
+        """Run detection on an image given as a path, encoded bytes or a BGR ndarray"""
+        # Decode and colour-convert once, then share the pixels between both models
+        rgb = self.preprocessor.load_rgb(image)
+
+        # First, check if the image is a maize leaf; the resized pixels are
+        # normalised straight into the classifier's input tensor
+        maize_result = self.maize_classifier.classify_in_place(
+            lambda tensor: self.preprocessor.model_input(rgb, "classifier", out=tensor)
+        )[0]
         
         # If not a maize leaf, return early with a message
         if not maize_result["is_maize"]:
-            return {
-                "result": "Not a maize leaf",
-                "description": "The uploaded image does not appear to be a maize leaf. Please upload an image of a maize plant.",
-                "confidence": round(maize_result["confidence"] * 100, 2),
-                "is_maize": False
-            }
+            return self.create_not_maize_result(maize_result)
         
-        # If it is a maize leaf, continue with fall armyworm detection
-        image = self.preprocess_image(image_path)
-
-        # Set input tensor
-        self.interpreter.set_tensor(self.input_details[0]['index'], image)
-
-        # Run inference
-        self.interpreter.invoke()
-
-        # Get output tensors - print shapes for debugging
-        print("Output tensor shapes:")
-        for i, output in enumerate(self.output_details):
-            tensor = self.interpreter.get_tensor(output['index'])
-            print(f"Output {i}: shape={tensor.shape}")
-
-        # Get output tensors
-        # The exact indices might need adjustment based on your model's output format
-        try:
-            # Try different output combinations
-            boxes = self.interpreter.get_tensor(self.output_details[0]['index'])
-            classes = self.interpreter.get_tensor(self.output_details[1]['index'])
-            scores = self.interpreter.get_tensor(self.output_details[2]['index'])
-
-            # Print shapes for debugging
-            print(f"Boxes shape: {boxes.shape}")
-            print(f"Classes shape: {classes.shape}")
-            print(f"Scores shape: {scores.shape}")
-
-            # Process detections
-            detections = self.process_detections(boxes, classes, scores)
-
-            # Determine final classification
-            final_classification = self.determine_final_class(detections)
-
-            # Create user-friendly result
-            result = self.create_user_friendly_result(final_classification)
-            
-            # Add maize classification info
+        # If it is a maize leaf, continue with fall armyworm detection, reading the outputs in place
+        return invoke_in_place(
+            self.interpreter, self.input_details[0]['index'],
+            lambda tensor: self.preprocessor.model_input(rgb, "detector", out=tensor),
+            self.output_indices,
+            lambda outputs: self.create_detection_result(outputs, maize_result)
+        )
+
+    def detect_batch(self, images):
+        """Run detection on several images, sharing one invoke per model"""
+        rgbs = [self.preprocessor.load_rgb(image) for image in images]
+        batch_size = self.padded_batch_size(len(images))
+
+        # Classify all images in one batch
+        maize_results = self.maize_classifier.classify_in_place(
+            lambda tensor: self.preprocessor.model_inputs(rgbs, "classifier", tensor),
+            batch_size, len(images)
+        )
+
+        results = [None] * len(images)
+        maize_indices = []
+        for i, maize_result in enumerate(maize_results):
+            if maize_result["is_maize"]:
+                maize_indices.append(i)
+            else:
+                results[i] = self.create_not_maize_result(maize_result)
+
+        if not maize_indices:
+            return results
+
+        # Run the armyworm model on the maize images only
+        batch_size = self.padded_batch_size(len(maize_indices))
+        maize_rgbs = [rgbs[i] for i in maize_indices]
+        detections = invoke_in_place(
+            self.interpreters.for_batch(batch_size), self.input_details[0]['index'],
+            lambda tensor: self.preprocessor.model_inputs(maize_rgbs, "detector", tensor),
+            self.output_indices,
+            self.create_batch_results
+        )
+
+        for row, i in enumerate(maize_indices):
+            result = detections[row]
             result["is_maize"] = True
-            result["maize_confidence"] = round(maize_result["confidence"] * 100, 2)
+            result["maize_confidence"] = round(maize_results[i]["confidence"] * 100, 2)
+            results[i] = result
 
-            return result
+        return results
 
-        except Exception as e:
-            print(f"Error with default output order: {e}")
+    def warmup(self, max_batch_size=1):
+        """Run every interpreter once on a blank input so the first real request does not pay for it"""
+        batch_size = 1
+        while batch_size <= self.padded_batch_size(max_batch_size):
+            self.maize_classifier.classify_in_place(lambda tensor: tensor.fill(0), batch_size)
+            invoke_in_place(
+                self.interpreters.for_batch(batch_size), self.input_details[0]['index'],
+                lambda tensor: tensor.fill(0), self.output_indices, lambda outputs: None
+            )
+
+            batch_size *= 2
+
+    def get_input_shapes(self):
+        """Return each model's input as [height, width, channels], e.g. for clients that resize before uploading"""
+        return {name: [height, width, 3] for name, (height, width) in self.preprocessor.input_sizes.items()}
+
+    def padded_batch_size(self, num_images):
+        """Round a batch up to a power of two so only a few batch interpreters are needed"""
+        batch_size = 1
+        while batch_size < num_images:
+            batch_size *= 2
+        return batch_size
+
+    def create_not_maize_result(self, maize_result):
+        """Create the result returned when the image is not a maize leaf"""
+        return {
+            "result": "Not a maize leaf",
+            "description": "The uploaded image does not appear to be a maize leaf. Please upload an image of a maize plant.",
+            "confidence": round(maize_result["confidence"] * 100, 2),
+            "is_maize": False
+        }
 
-        # Try alternative output order
-        try:
-            boxes = self.interpreter.get_tensor(self.output_details[1]['index'])
-            classes = self.interpreter.get_tensor(self.output_details[0]['index'])
-            scores = self.interpreter.get_tensor(self.output_details[2]['index'])
+    def create_batch_results(self, outputs):
+        """Decode the whole batch of armyworm outputs at once, then build one result per row"""
+        class_idx, scores = self.decode_outputs(outputs)
+        return [
+            self.create_user_friendly_result(self.select_final_class(class_idx[row], scores[row]))
+            for row in range(len(scores))
+        ]
 
-            # Print shapes for debugging
-            print(f"Alternative - Boxes shape: {boxes.shape}")
-            print(f"Alternative - Classes shape: {classes.shape}")
-            print(f"Alternative - Scores shape: {scores.shape}")
+    def create_detection_result(self, outputs, maize_result):
+        """Turn the armyworm model outputs for one image into a result dict"""
+        class_idx, scores = self.decode_outputs(outputs)
 
-            # Process detections
-            detections = self.process_detections(boxes, classes, scores)
+        # Determine final classification
+        final_classification = self.select_final_class(class_idx[0], scores[0])
 
-            # Determine final classification
-            final_classification = self.determine_final_class(detections)
+        # Create user-friendly result
+        result = self.create_user_friendly_result(final_classification)
+        
+        # Add maize classification info
+        result["is_maize"] = True
+        result["maize_confidence"] = round(maize_result["confidence"] * 100, 2)
 
-            # Create user-friendly result
-            result = self.create_user_friendly_result(final_classification)
-            
-            # Add maize classification info
-            result["is_maize"] = True
-            result["maize_confidence"] = round(maize_result["confidence"] * 100, 2)
+        return result
 
-            return result
+    def resolve_output_layout(self):
+        """Work out once, from the tensor shapes, which output holds boxes, classes and scores"""
+        shapes = [tuple(output['shape']) for output in self.output_details]
+        num_classes = len(CLASS_MAP)
+        boxes_index = classes_index = scores_index = None
+
+        for i, shape in enumerate(shapes):
+            if len(shape) == 3 and shape[-1] == 4 and boxes_index is None:
+                boxes_index = i
+            elif len(shape) == 3 and shape[-1] == 1 and scores_index is None:
+                scores_index = i
+            elif len(shape) == 3 and shape[-1] == num_classes and classes_index is None:
+                classes_index = i
+
+        # Models with post-processing output (1, N) classes and scores, in that order
+        remaining = [i for i, shape in enumerate(shapes) if len(shape) == 2 and i not in (boxes_index, classes_index, scores_index)]
+        if classes_index is None and remaining:
+            classes_index = remaining.pop(0)
+        if scores_index is None and remaining:
+            scores_index = remaining.pop(0)
+
+        if None in (boxes_index, classes_index, scores_index):
+            raise ValueError(f"Unrecognised detector output shapes: {shapes}")
+
+        return boxes_index, classes_index, scores_index
+
+    def decode_outputs(self, outputs):
+        """Return (batch, N) class indices and scores from the raw output tensors"""
+        classes = outputs[self.classes_index]
+        scores = dequantize(outputs[self.scores_index], self.output_details[self.scores_index])
+        batch_size = len(scores)
+
+        # Scores may carry a trailing (…, 1) dimension
+        scores = scores.reshape(batch_size, -1)
+
+        # Classes are either per-class scores (batch, N, num_classes) or indices (batch, N);
+        # quantization keeps the order of scores, so argmax works on the raw values
+        if classes.ndim == 3:
+            class_idx = classes.argmax(axis=-1)
+        else:
+            class_idx = np.rint(dequantize(classes, self.output_details[self.classes_index])).astype(np.int64)
 
-        except Exception as e2:
-            print(f"Error with alternative output order: {e2}")
-            raise e2
+        return class_idx, scores
 
     def create_user_friendly_result(self, classification):
         """Create a user-friendly result message"""
@@ -167,118 +253,67 @@ class FallArmywormDetector:
         return result
 
     def process_detections(self, boxes, classes, scores, threshold=0.5):
-        """Process the raw detection results"""
-        results = []
-
-        # Ensure we're working with the right dimensions
-        # If boxes has shape (1, N, 4), take the first batch
-        if len(boxes.shape) == 3:
-            boxes = boxes[0]
-
-        # If classes has shape (1, N), take the first batch
-        if len(classes.shape) == 2:
-            classes = classes[0]
-        elif len(classes.shape) == 3: # For one-hot encoded classes (1, N, num_classes)
-            classes = classes[0]
-
-        # If scores has shape (1, N), take the first batch
-        if len(scores.shape) == 2:
-            scores = scores[0]
-        elif len(scores.shape) == 3: # For scores with extra dimension (1, N, 1)
-            scores = scores[0, :, 0] if scores.shape[2] == 1 else scores[0]
-
-        print(f"After reshaping - Boxes: {boxes.shape}, Classes: {classes.shape}, Scores: {scores.shape}")
-
-        # Get the number of detections
-        num_detections = min(len(boxes), len(scores))
-
-        print(f"Processing {num_detections} detections")
-
-        # Process each detection
-        for i in range(num_detections):
-            try:
-                # Get score - ensure it's a scalar
-                score = float(scores[i]) if np.isscalar(scores[i]) else float(scores[i].item())
-
-                # Skip low confidence detections
-                if score < threshold:
-                    continue
-
-                # Get class - handle different class formats
-                if len(classes.shape) == 1: # Classes is a 1D array of indices
-                    class_idx = int(classes[i]) if np.isscalar(classes[i]) else int(classes[i].item())
-                else: # Classes is a 2D array, possibly one-hot encoded
-                    class_idx = int(np.argmax(classes[i]))
-
-                class_name = IDX_TO_CLASS.get(class_idx, f"Unknown-{class_idx}")
-
-                # Get box coordinates - ensure they're scalars
-                box = boxes[i]
-                box_list = [float(coord) if np.isscalar(coord) else float(coord.item()) for coord in box]
-
-                # Add detection to results
-                results.append({
-                    "class": class_name,
-                    "confidence": score,
-                    "box": box_list
-                })
-            except Exception as e:
-                print(f"Error processing detection {i}: {e}")
-                continue
-
-        return results
+        """Process the raw detection results for one image into a list of detections"""
+        outputs = [None] * len(self.output_details)
+        outputs[self.classes_index] = classes
+        outputs[self.scores_index] = scores
+        class_idx, scores = self.decode_outputs(outputs)
+        class_idx, scores = class_idx[0], scores[0]
+        boxes = dequantize(boxes, self.output_details[self.boxes_index]).reshape(-1, 4)
+
+        # Skip low confidence detections
+        keep = np.flatnonzero(scores >= threshold)
+
+        return [
+            {
+                "class": IDX_TO_CLASS.get(idx, f"Unknown-{idx}"),
+                "confidence": score,
+                "box": box
+            }
+            for idx, score, box in zip(class_idx[keep].tolist(), scores[keep].tolist(), boxes[keep].tolist())
+        ]
 
     def determine_final_class(self, detections):
-        """Determine the final class for the image based on detections"""
-        if not detections:
+        """Determine the final class for the image based on a list of detections"""
+        class_idx = np.array([CLASS_MAP.get(d["class"], -1) for d in detections], dtype=np.int64)
+        scores = np.array([d["confidence"] for d in detections], dtype=np.float32)
+        return self.select_final_class(class_idx, scores, threshold=0.0)
+
+    def select_final_class(self, class_idx, scores, threshold=0.5):
+        """Pick the final class for one image from its (N,) class indices and scores"""
+        confident = scores >= threshold
+        if not confident.any():
             return {
                 "class": "unknown",
                 "confidence": 0.0
             }
 
-        # Group detections by class
-        detections_by_class = {}
-        for detection in detections:
-            class_name = detection["class"]
-            if class_name not in detections_by_class:
-                detections_by_class[class_name] = []
-            detections_by_class[class_name].append(detection)
-
-        # Define priority classes (fall armyworm stages)
-        priority_classes = ["fall-armyworm-larval-damage", "fall-armyworm-egg"]
-
-        # Check if any priority classes are detected
-        for priority_class in priority_classes:
-            if priority_class in detections_by_class:
-                # Get the highest confidence detection for this class
-                best_detection = max(detections_by_class[priority_class], key=lambda x: x["confidence"])
+        # Fall armyworm stages take priority, then healthy maize, then frass
+        for class_name in FINAL_CLASS_PRIORITY:
+            matches = confident & (class_idx == CLASS_MAP[class_name])
+            if matches.any():
                 return {
-                    "class": priority_class,
-                    "confidence": best_detection["confidence"]
+                    "class": class_name,
+                    "confidence": float(scores[matches].max())
                 }
 
-        # If no priority classes, check for healthy-maize
-        if "healthy-maize" in detections_by_class:
-            best_detection = max(detections_by_class["healthy-maize"], key=lambda x: x["confidence"])
-            return {
-                "class": "healthy-maize",
-                "confidence": best_detection["confidence"]
-            }
-
-        # If only frass or nothing else recognized, return frass or unknown
-        if "fall-armyworm-frass" in detections_by_class:
-            best_detection = max(detections_by_class["fall-armyworm-frass"], key=lambda x: x["confidence"])
-            return {
-                "class": "fall-armyworm-frass",
-                "confidence": best_detection["confidence"]
-            }
-
         # Fallback to highest confidence detection of any class
-        highest_conf_detection = max(detections, key=lambda x: x["confidence"])
+        best = int(np.argmax(np.where(confident, scores, -np.inf)))
+        idx = int(class_idx[best])
         return {
-            "class": highest_conf_detection["class"],
-            "confidence": highest_conf_detection["confidence"]
+            "class": IDX_TO_CLASS.get(idx, f"Unknown-{idx}"),
+            "confidence": float(scores[best])
         }
 
-# Initialize the detector
-detector = FallArmywormDetector()
+# The detector is created on first use rather than at import time, so
+# importing this module does not load TensorFlow or the models
+_detector = None
+_detector_lock = threading.Lock()
+
+def get_detector():
+    """Return the shared detector, loading the models on first use"""
+    global _detector
+    with _detector_lock:
+        if _detector is None:
+            _detector = FallArmywormDetector()
+    return _detector
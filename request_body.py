@@ -0,0 +1,164 @@
+from image_utils import RGBImage
+
+# Bodies are read from the socket in pieces of this size
+READ_CHUNK_BYTES = 64 * 1024
+
+# Raw uint8 RGB pixels, row by row, sized by the X-Image-Width/X-Image-Height headers
+RAW_RGB_CONTENT_TYPE = 'application/x-raw-rgb'
+ENCODED_CONTENT_TYPES = ['image/jpeg', 'image/png', 'image/webp', 'image/bmp']
+
+
+class UploadTooLarge(Exception):
+    """Raised when a request body is over the size limit"""
+    pass
+
+
+class IncompleteUpload(Exception):
+    """Raised when the client disconnects before sending the declared body"""
+    pass
+
+
+def declared_length(value):
+    """Parse a Content-Length header, None when it is missing or malformed"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    return int(value) if value.isdigit() else None
+
+
+def read_body(stream, content_length, max_size):
+    """
+    Read a request body into a single buffer and return a memoryview of it.
+
+    With a Content-Length the buffer is allocated once at its final size and
+    filled in place with readinto(), so the upload is held in memory exactly
+    once and goes to cv2.imdecode without another copy. Chunked bodies grow
+    the buffer instead. Either way the body is cut off at max_size.
+    """
+    if content_length is None:
+        buffer = bytearray()
+        while True:
+            chunk = stream.read(READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            if len(buffer) + len(chunk) > max_size:
+                raise UploadTooLarge(f"Upload is larger than {max_size} bytes")
+            buffer += chunk
+        return memoryview(buffer)
+
+    if content_length > max_size:
+        raise UploadTooLarge(f"Upload is larger than {max_size} bytes")
+
+    buffer = bytearray(content_length)
+    view = memoryview(buffer)
+    received = 0
+    readinto = getattr(stream, 'readinto', None)
+    while received < content_length:
+        if readinto is not None:
+            count = readinto(view[received:received + READ_CHUNK_BYTES])
+        else:
+            chunk = stream.read(min(READ_CHUNK_BYTES, content_length - received))
+            count = len(chunk)
+            view[received:received + count] = chunk
+        if not count:
+            break
+        received += count
+
+    if received < content_length:
+        raise IncompleteUpload(f"Upload ended after {received} of {content_length} bytes")
+    return view
+
+
+async def read_body_async(chunks, content_length, max_size):
+    """read_body() for an async iterator of chunks, e.g. Starlette's request.stream()"""
+    if content_length is not None and content_length > max_size:
+        raise UploadTooLarge(f"Upload is larger than {max_size} bytes")
+
+    # Copy each chunk into place as it arrives; a wrong Content-Length falls back to growing
+    buffer = bytearray(content_length or 0)
+    received = 0
+    async for chunk in chunks:
+        if received + len(chunk) > max_size:
+            raise UploadTooLarge(f"Upload is larger than {max_size} bytes")
+        buffer[received:received + len(chunk)] = chunk
+        received += len(chunk)
+
+    if content_length is not None and received < content_length:
+        raise IncompleteUpload(f"Upload ended after {received} of {content_length} bytes")
+    return memoryview(buffer)
+
+
+def read_location(*sources):
+    """
+    Return (latitude, longitude) from the first source that has both, e.g.
+    the X-Latitude/X-Longitude headers, then form fields or query parameters.
+
+    Each source is a mapping; keys are tried as 'latitude'/'longitude' and
+    as 'x-latitude'/'x-longitude'. Raises ValueError when none has them or
+    they are not valid coordinates.
+    """
+    for source in sources:
+        for lat_key, lon_key in (('x-latitude', 'x-longitude'), ('latitude', 'longitude'), ('lat', 'lon')):
+            latitude = source.get(lat_key)
+            longitude = source.get(lon_key)
+            if latitude is None or longitude is None:
+                continue
+            try:
+                latitude = float(latitude)
+                longitude = float(longitude)
+            except ValueError:
+                raise ValueError("Latitude and longitude must be numbers")
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                raise ValueError("Latitude and longitude are out of range")
+            return latitude, longitude
+    raise ValueError("Location data (latitude and longitude) is required")
+
+
+def is_multipart(content_type):
+    """True for multipart/form-data bodies"""
+    return (content_type or '').split(';')[0].strip().lower() == 'multipart/form-data'
+
+
+def is_raw_rgb(content_type):
+    """True when the body is raw RGB pixels rather than an encoded image"""
+    return (content_type or '').split(';')[0].strip().lower() == RAW_RGB_CONTENT_TYPE
+
+
+def raw_rgb_image(data, headers):
+    """Wrap a raw RGB body in an RGBImage using its X-Image-Width/X-Image-Height headers"""
+    width = headers.get('x-image-width')
+    height = headers.get('x-image-height')
+    if width is None or height is None or not width.isdigit() or not height.isdigit():
+        raise ValueError("Raw RGB uploads need X-Image-Width and X-Image-Height headers")
+    return RGBImage(data, width, height)
+
+
+def describe_capabilities(input_shapes, max_upload_bytes):
+    """
+    Build the /api/capabilities document: the models' input shapes and the
+    upload a client should send so the server does as little work as possible.
+
+    Images are stretched to each model's input, so a client resizing to the
+    largest input (without keeping the aspect ratio) sends everything the
+    models will use and nothing more.
+    """
+    height = max(shape[0] for shape in input_shapes.values())
+    width = max(shape[1] for shape in input_shapes.values())
+    return {
+        "models": {name: {"input_shape": shape} for name, shape in input_shapes.items()},
+        "preferred_upload": {
+            "width": width,
+            "height": height,
+            "resize": "stretch",
+            "content_type": "image/jpeg",
+            "jpeg_quality": 90
+        },
+        "raw_rgb": {
+            "content_type": RAW_RGB_CONTENT_TYPE,
+            "layout": "height x width x 3, uint8, RGB, row-major",
+            "headers": ["X-Image-Width", "X-Image-Height"],
+            "bytes": width * height * 3
+        },
+        "accepted_content_types": ENCODED_CONTENT_TYPES + [RAW_RGB_CONTENT_TYPE],
+        "max_upload_bytes": max_upload_bytes
+    }
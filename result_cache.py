@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from image_utils import RGBImage
+from map.database_schema import ThreadConnection
+
+
+def make_cache_key(image, model_version):
+    """Hash an image (encoded bytes, BGR ndarray or RGBImage) together with the model version"""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(model_version.encode())
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        # Hashing the upload itself is several times cheaper than decoding it
+        digest.update(b"encoded")
+        digest.update(image)
+        return digest.hexdigest()
+    if isinstance(image, RGBImage):
+        # Kept apart from BGR arrays that happen to hold the same bytes
+        digest.update(b"rgb")
+        image = image.pixels
+    digest.update(str(image.shape).encode())
+    digest.update(image.tobytes() if not image.flags['C_CONTIGUOUS'] else image.data)
+    return digest.hexdigest()
+
+
+class SqliteResultStore:
+    """
+    Optional shared cache tier, so cached results survive worker restarts.
+
+    Each thread keeps one connection, closed when the thread exits. Expired
+    rows are deleted at most every prune_interval seconds, through the
+    expires_at index, instead of on every put.
+    """
+    def __init__(self, db_path="result_cache.db", busy_timeout=5, prune_interval=60):
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self.prune_interval = prune_interval
+        self.pruned_at = 0.0
+        self.prune_lock = threading.Lock()
+        self.local = threading.local()
+
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS result_cache (
+            key TEXT PRIMARY KEY,
+            result TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_result_cache_expires_at ON result_cache (expires_at)")
+        conn.commit()
+        conn.close()
+
+    def connection(self):
+        """Return this thread's connection, opening a new one in a forked worker"""
+        holder = getattr(self.local, 'holder', None)
+        if holder is None or holder.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # The parent's connection is left alone rather than used or closed across fork()
+            self.local.inherited = holder
+            holder = ThreadConnection(conn)
+            self.local.holder = holder
+        return holder.conn
+
+    def get(self, key):
+        """Return a cached result that has not expired, or None"""
+        row = self.connection().execute(
+            "SELECT result FROM result_cache WHERE key = ? AND expires_at > ?",
+            (key, time.time())
+        ).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, result, expires_at):
+        """Store a result, dropping expired rows now and then"""
+        conn = self.connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO result_cache (key, result, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(result), expires_at)
+            )
+            if self.prune_due():
+                conn.execute("DELETE FROM result_cache WHERE expires_at <= ?", (time.time(),))
+
+    def prune_due(self):
+        """True for one caller every prune_interval seconds in this process"""
+        now = time.monotonic()
+        with self.prune_lock:
+            if now - self.pruned_at < self.prune_interval:
+                return False
+            self.pruned_at = now
+            return True
+
+
+class ResultCache:
+    """
+    In-memory LRU cache of detection results with a time-to-live and a
+    memory budget, optionally backed by a SqliteResultStore.
+    """
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=3600, store=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.store = store
+
+        self.entries = OrderedDict()  # key -> (expires_at, size, result)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.store_errors = 0
+
+    def get(self, key):
+        """Return a copy of the cached result for key, or None"""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, size, result = entry
+                if expires_at > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(result)
+                self.remove(key)
+
+        if self.store is not None:
+            result = self.store_call(self.store.get, key)
+            if result is not None:
+                self.add(key, result, now + self.ttl)
+                with self.lock:
+                    self.store_hits += 1
+                return dict(result)
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, result):
+        """Cache a copy of result under key"""
+        expires_at = time.time() + self.ttl
+        self.add(key, dict(result), expires_at)
+
+        if self.store is not None:
+            self.store_call(self.store.put, key, result, expires_at)
+
+    def store_call(self, method, *args):
+        """Call the store, treating a failure (e.g. a locked database) as a miss rather than failing the detection"""
+        try:
+            return method(*args)
+        except Exception as e:
+            with self.lock:
+                self.store_errors += 1
+            print(f"Warning: result cache store failed: {e}")
+            return None
+
+    def add(self, key, result, expires_at):
+        """Add an entry to the memory tier, evicting least recently used entries over budget"""
+        # Approximate the memory an entry holds by its serialised size plus dict overhead
+        size = len(json.dumps(result)) + 256
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.remove(key)
+            self.entries[key] = (expires_at, size, result)
+            self.size += size
+
+            while self.size > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self.remove(oldest)
+                self.evictions += 1
+
+    def remove(self, key):
+        """Remove an entry; the caller must hold the lock"""
+        expires_at, size, result = self.entries.pop(key)
+        self.size -= size
+
+    def get_stats(self):
+        """Return hit/miss counters and memory use"""
+        with self.lock:
+            lookups = self.hits + self.store_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "store_errors": self.store_errors,
+                "hit_rate": (self.hits + self.store_hits) / lookups if lookups else 0.0
+            }
+
+
+class CachedDetectionService:
+    """
+    Sits in front of a detector (or pool/scheduler) and skips inference for
+    images it has already seen with the same models.
+
+    Images are hashed in the form they arrive in and handed to the detector
+    unchanged on a miss, so a hit never decodes and the detector decodes
+    (and converts in place) only what it has to.
+    """
+    def __init__(self, detector, cache, model_version):
+        self.detector = detector
+        self.cache = cache
+        self.model_version = model_version
+
+    def hashable(self, image):
+        """Read images given as a path, so the file is read once for the key and the detector"""
+        if isinstance(image, str):
+            with open(image, "rb") as f:
+                return f.read()
+        return image
+
+    def detect(self, image):
+        """Return the cached result for an image, running detection on a miss"""
+        image = self.hashable(image)
+        key = make_cache_key(image, self.model_version)
+
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+
+        result = self.detector.detect(image)
+        self.cache.put(key, result)
+
+        return result
+
+    def detect_batch(self, images):
+        """Batched detect(); only cache misses go to the detector"""
+        images = [self.hashable(image) for image in images]
+        keys = [make_cache_key(image, self.model_version) for image in images]
+        results = [self.cache.get(key) for key in keys]
+
+        misses = [i for i, result in enumerate(results) if result is None]
+        if misses:
+            detected = self.detector.detect_batch([images[i] for i in misses])
+            for i, result in zip(misses, detected):
+                self.cache.put(keys[i], result)
+                results[i] = result
+
+        return results
+
+    def get_stats(self):
+        """Return cache statistics"""
+        return self.cache.get_stats()
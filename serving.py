@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+from model_utils import get_detector
+from batching import BatchScheduler
+from interpreter_pool import DetectorPool
+from result_cache import CachedDetectionService, ResultCache, SqliteResultStore
+from inference_sidecar import SidecarDetectionService
+
+
+def create_detection_service(use_sidecar=True):
+    """
+    Build and warm up the object the endpoints call detect() on.
+
+    Configured through environment variables:
+    - FAW_INFERENCE_SIDECAR: socket of an inference_sidecar.py process; when set
+      detections are forwarded to it and this process never loads the models
+    - FAW_SIDECAR_CONNECTIONS: connections to the sidecar, i.e. detections in flight from this process
+    - FAW_POOL_SIZE: number of interpreter pairs, i.e. detections that can run at once
+    - FAW_BATCH_MAX_SIZE: batch concurrent requests together when greater than 1
+    - FAW_BATCH_MAX_WAIT_MS: how long the first request in a batch waits for others
+    - FAW_RESULT_CACHE_MB: memory budget for cached results of repeated uploads, 0 disables the cache
+    - FAW_RESULT_CACHE_TTL: seconds a cached result stays valid
+    - FAW_RESULT_CACHE_DB: optional SQLite file shared by all workers as a second cache tier
+    """
+    pool_size = int(os.environ.get("FAW_POOL_SIZE", "1"))
+    max_batch_size = int(os.environ.get("FAW_BATCH_MAX_SIZE", "1"))
+    max_wait_ms = float(os.environ.get("FAW_BATCH_MAX_WAIT_MS", "5"))
+    cache_mb = float(os.environ.get("FAW_RESULT_CACHE_MB", "32"))
+    cache_ttl = float(os.environ.get("FAW_RESULT_CACHE_TTL", "3600"))
+    cache_db = os.environ.get("FAW_RESULT_CACHE_DB")
+
+    sidecar = os.environ.get("FAW_INFERENCE_SIDECAR")
+    if use_sidecar and sidecar:
+        # Pooling, batching and caching are configured on the sidecar
+        authkey = os.environ.get("FAW_SIDECAR_AUTHKEY")
+        return SidecarDetectionService(
+            sidecar, authkey.encode() if authkey else None,
+            max_connections=int(os.environ.get("FAW_SIDECAR_CONNECTIONS", "4"))
+        )
+
+    detector = get_detector()
+
+    # Even a pool of one serialises access, so threaded workers never share an interpreter
+    pool = DetectorPool(pool_size, detectors=[detector])
+    pool.warmup(max_batch_size)
+    service = pool
+
+    if max_batch_size > 1:
+        service = BatchScheduler(service, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, workers=pool_size)
+
+    # Retried uploads of the same photo skip inference entirely
+    if cache_mb > 0:
+        store = SqliteResultStore(cache_db) if cache_db else None
+        cache = ResultCache(max_bytes=int(cache_mb * 1024 * 1024), ttl=cache_ttl, store=store)
+        service = CachedDetectionService(service, cache, detector.model_version)
+
+    return service
+
+
+# The service is built on first use, or in the background by start_loading()
+_service = None
+_service_lock = threading.Lock()
+_loader = None
+_loader_lock = threading.Lock()
+_ready = threading.Event()
+
+
+def get_detection_service():
+    """Return the detection service, loading and warming up the models on first use"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            started = time.monotonic()
+            _service = create_detection_service()
+            print(f"Detection service ready in {time.monotonic() - started:.2f}s")
+            _ready.set()
+    return _service
+
+
+def start_loading():
+    """Load the models in a background thread, e.g. right after a gunicorn worker forks"""
+    global _loader
+    with _loader_lock:
+        if _loader is None and not _ready.is_set():
+            _loader = threading.Thread(target=load_in_background, name="model-loader", daemon=True)
+            _loader.start()
+
+
+def load_in_background():
+    """Thread target for start_loading(); a failed load can be retried by calling start_loading() again"""
+    global _loader
+    try:
+        get_detection_service()
+    except Exception as e:
+        print(f"Loading detection models failed: {e}")
+    finally:
+        with _loader_lock:
+            _loader = None
+
+
+def is_ready():
+    """True once the models are loaded and warmed up"""
+    return _ready.is_set()
+
+
+def get_models():
+    """
+    Return what describes the loaded models (model_version, get_input_shapes()):
+    the local detector, or the sidecar client when inference runs in a sidecar
+    """
+    service = get_detection_service()
+    if isinstance(service, SidecarDetectionService):
+        return service
+    return get_detector()
+
+
+def loaded_detection_service():
+    """Return the detection service if it has been built, without triggering a load"""
+    return _service
+
+
+class LazyDetectionService:
+    """Stands in for the detection service and builds it on first use"""
+    def detect(self, image):
+        return get_detection_service().detect(image)
+
+    def detect_batch(self, images):
+        return get_detection_service().detect_batch(images)
+
+
+detection_service = LazyDetectionService()
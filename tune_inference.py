@@ -0,0 +1,166 @@
+"""
+Tune interpreter threads, worker processes and XNNPACK for this host.
+
+    python tune_inference.py
+    python tune_inference.py --max-p90-ms 250 --duration 10
+
+Every combination of worker processes, interpreter threads per model and
+XNNPACK on or off (workers x threads no more than the CPUs by default) is
+run as that many fresh processes at once. Each loads both models with the
+settings and runs the classifier and the detector on a sample image in a
+loop for --duration seconds, as a fully loaded server would. The script
+prints throughput and latency per combination and writes the best one, the
+highest throughput within --max-p90-ms, to FAW_INFERENCE_CONFIG (default
+inference_config.json). FallArmywormDetector and MaizeLeafClassifier read
+that file at startup and gunicorn.conf.py takes its worker count.
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+WORKER = '''
+import json, os, sys, time
+sys.path.insert(0, os.getcwd())
+from model_utils import FallArmywormDetector
+from inference_backend import invoke_in_place
+
+detector = FallArmywormDetector()
+preprocessor = detector.preprocessor
+with open(sys.argv[1], "rb") as f:
+    rgb = preprocessor.load_rgb(f.read())
+
+def step():
+    # Both models on every image, whatever the classifier decides
+    detector.maize_classifier.classify_in_place(lambda tensor: preprocessor.model_input(rgb, "classifier", out=tensor))
+    invoke_in_place(
+        detector.interpreter, detector.input_details[0]["index"],
+        lambda tensor: preprocessor.model_input(rgb, "detector", out=tensor),
+        detector.output_indices, lambda outputs: None
+    )
+
+for _ in range(3):
+    step()
+print("ready", flush=True)
+sys.stdin.readline()
+
+timings = []
+deadline = time.perf_counter() + float(sys.argv[2])
+while time.perf_counter() < deadline:
+    started = time.perf_counter()
+    step()
+    timings.append((time.perf_counter() - started) * 1000)
+print(json.dumps(timings))
+'''
+
+
+def candidates(limit):
+    """1, 2, 4, ... up to limit"""
+    values = [1]
+    while values[-1] * 2 <= limit:
+        values.append(values[-1] * 2)
+    return values
+
+
+def run(workers, threads, xnnpack, image, duration):
+    """Run one combination and return (images per second, p50 ms, p90 ms)"""
+    settings = {"num_threads": threads, "xnnpack": xnnpack}
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump({"models": {"classifier": settings, "detector": settings}}, f)
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL="3", FAW_INFERENCE_CONFIG=f.name)
+
+    processes = [
+        subprocess.Popen(
+            [sys.executable, "-c", WORKER, image, str(duration)],
+            cwd=ROOT, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+        )
+        for _ in range(workers)
+    ]
+    try:
+        # Start timing only once every worker has loaded, so they all run together
+        for process in processes:
+            while process.stdout.readline().strip() != "ready":
+                if process.poll() is not None:
+                    raise RuntimeError(f"Worker failed to start with {settings}")
+        for process in processes:
+            process.stdin.write("go\n")
+            process.stdin.flush()
+        timings = []
+        for process in processes:
+            timings.extend(json.loads(process.stdout.readline()))
+            process.wait()
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+        os.unlink(f.name)
+
+    timings.sort()
+    return len(timings) / duration, timings[len(timings) // 2], timings[int(len(timings) * 0.9)]
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image", help="sample photo (default: the first one in uploads/)")
+    parser.add_argument("--duration", type=float, default=5, help="seconds each combination runs")
+    parser.add_argument("--max-workers", type=int, default=cpus)
+    parser.add_argument("--max-threads", type=int, default=cpus)
+    parser.add_argument("--oversubscribe", action="store_true", help="also try workers x threads above the CPU count")
+    parser.add_argument("--max-p90-ms", type=float, help="only pick combinations whose p90 latency is within this")
+    parser.add_argument("--output", default=os.environ.get("FAW_INFERENCE_CONFIG", "inference_config.json"))
+    parser.add_argument("--dry-run", action="store_true", help="print the results without writing the config")
+    args = parser.parse_args()
+
+    image = args.image or sorted(glob.glob(os.path.join(ROOT, "uploads", "*")))[0]
+    combinations = [
+        (workers, threads, xnnpack)
+        for workers in candidates(args.max_workers)
+        for threads in candidates(args.max_threads)
+        if args.oversubscribe or workers * threads <= cpus
+        for xnnpack in (True, False)
+    ]
+
+    print(f"{cpus} CPUs, {len(combinations)} combinations of {args.duration:g}s")
+    print(f"{'workers':>7} {'threads':>7} {'xnnpack':>7} {'images/s':>9} {'p50 ms':>7} {'p90 ms':>7}")
+    results = []
+    for workers, threads, xnnpack in combinations:
+        throughput, p50, p90 = run(workers, threads, xnnpack, image, args.duration)
+        results.append((throughput, p50, p90, workers, threads, xnnpack))
+        print(f"{workers:>7} {threads:>7} {'on' if xnnpack else 'off':>7} {throughput:>9.1f} {p50:>7.1f} {p90:>7.1f}")
+
+    eligible = [r for r in results if args.max_p90_ms is None or r[2] <= args.max_p90_ms]
+    if not eligible:
+        sys.exit(f"No combination has a p90 latency within {args.max_p90_ms}ms")
+    throughput, p50, p90, workers, threads, xnnpack = max(eligible)
+    print(f"\nBest: {workers} workers, {threads} threads, XNNPACK {'on' if xnnpack else 'off'} ({throughput:.1f} images/s, p90 {p90:.1f}ms)")
+    if args.dry_run:
+        return
+
+    settings = {"num_threads": threads, "xnnpack": xnnpack}
+    config = {
+        "workers": workers,
+        "models": {"classifier": settings, "detector": settings},
+        "measured": {
+            "host": platform.node(),
+            "cpus": cpus,
+            "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "images_per_second": round(throughput, 1),
+            "p50_ms": round(p50, 1),
+            "p90_ms": round(p90, 1)
+        }
+    }
+    with open(args.output, "w") as f:
+        json.dump(config, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()